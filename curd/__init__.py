@@ -1,5 +1,6 @@
 from .errors import (
     ConnectError, UnexpectedError, OperationFailure, ProgrammingError,
-    DuplicateKeyError
+    DuplicateKeyError, PoolTimeout, CircuitOpenError
 )
-from .session import Session, F, SimpleCollection
+from .session import Session, AsyncSession, F, SimpleCollection
+from .connections.retry import RetryPolicy, RetryBudget
@@ -0,0 +1,241 @@
+import time
+import threading
+
+from .connections import (
+    logger, CURD_FUNCTIONS, ITER_FUNCTIONS, BULK_FUNCTIONS, ASYNC_FUNCTIONS
+)
+from .errors import (
+    ConnectError, OperationFailure, PoolTimeout, CircuitOpenError
+)
+
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# errors of an unreachable or failing database
+FAILURE_ERRORS = (ConnectError, OperationFailure)
+# raised before reaching database
+NON_FAILURE_ERRORS = (PoolTimeout, CircuitOpenError)
+
+
+def is_failure(error):
+    return isinstance(error, FAILURE_ERRORS) and \
+        not isinstance(error, NON_FAILURE_ERRORS)
+
+
+class CircuitBreaker(object):
+    """
+    closed: requests go through, opens after failure_threshold consecutive
+        ConnectError / OperationFailure results
+    open: requests fail fast with CircuitOpenError for reset_timeout seconds
+    half_open: at most half_open_max_calls probe requests go through at once,
+        closes after success_threshold successful probes, opens again on
+        a failed one. a probe ending in another error (PoolTimeout,
+        ProgrammingError, ...) only gives its slot back
+    on_state_change(breaker, old_state, new_state) is called on transitions
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, half_open_max_calls=1,
+                 success_threshold=1, on_state_change=None, name=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+        self.on_state_change = on_state_change
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes = 0
+        self._successes = 0
+        self._generation = 0  # of half-open periods, probes are counted in theirs
+        self.failures = 0  # consecutive
+        self.rejected = 0
+
+    def _set_state(self, state):
+        # called with lock held, return transition to report
+        old, self._state = self._state, state
+        self._generation += 1
+        self._probes = 0
+        self._successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self.failures = 0
+        return old, state
+
+    def _refresh(self):
+        if self._state == OPEN and \
+                time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self._set_state(HALF_OPEN)
+        return None
+
+    def _report(self, transitions):
+        if not self.on_state_change:
+            return
+        for old, new in transitions:
+            try:
+                self.on_state_change(self, old, new)
+            except Exception as e:
+                logger.warning('circuit breaker callback: {}'.format(e))
+
+    @property
+    def state(self):
+        with self._lock:
+            transition = self._refresh()
+            state = self._state
+        self._report([transition] if transition else [])
+        return state
+
+    def before_call(self):
+        """
+        return probe token passed to after_call, None if circuit is closed,
+        raise CircuitOpenError if call is not allowed
+        """
+        with self._lock:
+            transition = self._refresh()
+            state = self._state
+            probe, allowed = None, False
+            if state == CLOSED:
+                allowed = True
+            elif state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                probe, allowed = self._generation, True
+            else:
+                self.rejected += 1
+        self._report([transition] if transition else [])
+
+        if not allowed:
+            raise CircuitOpenError(
+                origin_error=Exception(
+                    'circuit of {} is {}, reset timeout {}s'.format(
+                        self.name, state, self.reset_timeout)
+                )
+            )
+        return probe
+
+    def after_call(self, probe, error=None):
+        failed = error is not None and is_failure(error)
+        transitions = []
+        with self._lock:
+            if probe is not None:
+                if probe != self._generation:
+                    pass  # probe of an earlier half-open period
+                elif failed:
+                    transitions.append(self._set_state(OPEN))
+                else:
+                    self._probes -= 1
+                    if error is None:
+                        self._successes += 1
+                        if self._successes >= self.success_threshold:
+                            transitions.append(self._set_state(CLOSED))
+            elif self._state == CLOSED:
+                if failed:
+                    self.failures += 1
+                    if self.failures >= self.failure_threshold:
+                        transitions.append(self._set_state(OPEN))
+                elif not isinstance(error, NON_FAILURE_ERRORS):
+                    # database answered
+                    self.failures = 0
+        self._report(transitions)
+
+    def info(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'rejected': self.rejected
+        }
+
+
+class CircuitBreakerConnectionPool(object):
+    """
+    circuit breaker in front of a connection pool, see CircuitBreaker.
+    circuit_breaker conf, all optional
+        failure_threshold: consecutive failures to open, default 5
+        reset_timeout: seconds open before probing, default 30
+        half_open_max_calls: concurrent probes, default 1
+        success_threshold: successful probes to close, default 1
+        on_state_change: callable(breaker, old_state, new_state)
+        name: name of breaker in errors and callbacks, default db type
+    iterators are checked on first next() and their result recorded when
+    exhausted, closed or collected, cassandra futures when done
+    """
+
+    def __init__(self, pool, conf=None, name=None):
+        conf = conf or {}
+        self._pool = pool
+        self.breaker = CircuitBreaker(
+            conf.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+            conf.get('reset_timeout', DEFAULT_RESET_TIMEOUT),
+            conf.get('half_open_max_calls', 1),
+            conf.get('success_threshold', 1),
+            conf.get('on_state_change', None),
+            conf.get('name', name)
+        )
+
+        for func in CURD_FUNCTIONS + BULK_FUNCTIONS:
+            if hasattr(pool, func):
+                setattr(self, func, self._wrap_func(func))
+        for func in ITER_FUNCTIONS + ('scan', ):
+            if hasattr(pool, func):
+                setattr(self, func, self._wrap_iter_func(func))
+        for func in ASYNC_FUNCTIONS:
+            if hasattr(pool, func):
+                setattr(self, func, self._wrap_async_func(func))
+
+    def __getattr__(self, item):
+        return getattr(self._pool, item)
+
+    def _wrap_func(self, func):
+        def call(*args, **kwargs):
+            probe = self.breaker.before_call()
+            try:
+                result = getattr(self._pool, func)(*args, **kwargs)
+            except BaseException as e:
+                self.breaker.after_call(probe, e)
+                raise
+            self.breaker.after_call(probe)
+            return result
+        return call
+
+    def _wrap_iter_func(self, func):
+        def call(*args, **kwargs):
+            # checked on first next(), an iterator never started holds no probe
+            probe = self.breaker.before_call()
+            try:
+                yield from getattr(self._pool, func)(*args, **kwargs)
+            except BaseException as e:
+                # GeneratorExit of close() or GC only gives the probe back
+                self.breaker.after_call(probe, e)
+                raise
+            self.breaker.after_call(probe)
+        return call
+
+    def _wrap_async_func(self, func):
+        def call(*args, **kwargs):
+            probe = self.breaker.before_call()
+            try:
+                future = getattr(self._pool, func)(*args, **kwargs)
+            except BaseException as e:
+                self.breaker.after_call(probe, e)
+                raise
+            future.add_done_callback(
+                lambda f: self.breaker.after_call(
+                    probe, None if f.cancelled() else f.exception()))
+            return future
+        return call
+
+    def circuit_info(self):
+        """
+        state, consecutive failures and rejected requests
+        """
+        return self.breaker.info()
+
+    def close(self):
+        self._pool.close()
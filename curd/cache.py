@@ -0,0 +1,352 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from .connections import DEFAULT_FILTER_LIMIT, DEFAULT_GET_MANY_CHUNK_SIZE
+
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60
+
+# functions which change rows of their collection
+WRITE_FUNCTIONS = (
+    'create', 'create_many', 'update', 'update_many', 'delete', 'delete_many'
+)
+# options which don't change results
+NON_QUERY_OPTIONS = ('timeout', 'retry')
+
+
+def freeze(value):
+    """
+    hashable form of filters, fields and options
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    elif isinstance(value, set):
+        return tuple(sorted(freeze(v) for v in value))
+    else:
+        return value
+
+
+def normalize_filters(filters):
+    return tuple((op.upper(), k, freeze(v)) for op, k, v in filters or [])
+
+
+def normalize_options(options):
+    return freeze(dict(
+        (k, v) for k, v in options.items() if k not in NON_QUERY_OPTIONS))
+
+
+def copy_result(result):
+    # callers may change returned rows, cache keeps its own
+    if isinstance(result, list):
+        return [dict(row) for row in result]
+    elif isinstance(result, tuple):
+        # result_format tuples, rows are immutable
+        columns, rows = result
+        return list(columns), list(rows)
+    elif isinstance(result, dict):
+        # a row, or value lists/arrays of result_format columns
+        return dict((k, copy.copy(v)) for k, v in result.items())
+    else:
+        return result
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results with per collection TTL.
+    every collection has a version which is increased by invalidation,
+    results read before an invalidation are not stored
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL,
+                 collections=None):
+        self.size = size
+        self.ttl = ttl
+        self.collection_ttls = collections or {}
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key: (collection, result, expire_at)
+        self._keys = {}  # collection: set of keys
+        self._versions = {}
+        self._epoch = 0  # version of all collections
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def collection_ttl(self, collection):
+        return self.collection_ttls.get(collection, self.ttl)
+
+    def version(self, collection):
+        return self._epoch, self._versions.get(collection, 0)
+
+    def get(self, key):
+        """
+        return (found, result)
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                collection, result, expire_at = entry
+                if expire_at is None or expire_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, copy_result(result)
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def put(self, key, collection, result, version):
+        ttl = self.collection_ttl(collection)
+        if ttl == 0:
+            return
+        expire_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if self.version(collection) != version:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (collection, copy_result(result), expire_at)
+            self._keys.setdefault(collection, set()).add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        collection, _, _ = self._entries.pop(key)
+        keys = self._keys[collection]
+        keys.discard(key)
+        if not keys:
+            del self._keys[collection]
+
+    def invalidate(self, collection=None):
+        """
+        drop results of collection, or all results
+        """
+        with self._lock:
+            if collection is None:
+                self._epoch += 1
+                self._entries = OrderedDict()
+                self._keys = {}
+            else:
+                self._versions[collection] = self._versions.get(collection, 0) + 1
+                for key in list(self._keys.get(collection, ())):
+                    self._remove(key)
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries)
+            }
+
+
+class Flight(object):
+    def __init__(self, collection):
+        self.collection = collection
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    identical concurrent calls share one in-flight call,
+    waiting callers get a copy of its result or its error
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.coalesced = 0
+
+    def do(self, key, collection, func, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key, None)
+            if flight is None:
+                flight = Flight(collection)
+                self._flights[key] = flight
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy_result(flight.result)
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return copy_result(flight.result)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key, None) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self, collection=None):
+        """
+        calls started later don't join in-flight calls of collection,
+        which may have read rows before a write
+        """
+        with self._lock:
+            for key, flight in list(self._flights.items()):
+                if collection is None or flight.collection == collection:
+                    del self._flights[key]
+
+
+class CachedConnectionPool(object):
+    """
+    read-through cache and single-flight in front of filter, get, exist and
+    get_many of a connection pool, writes through this pool invalidate their
+    collection, `execute` of anything but SELECT invalidates all.
+    cache conf, all optional
+        size: max cached results, least recently used are evicted
+        ttl: seconds results are kept, None for no expiry
+        collections: ttl of collections, like {'db.config': 10},
+            0 disables cache of a collection
+    with single_flight, concurrent identical filter/get/exist share one
+    database call, cache conf may be None to coalesce without caching
+    """
+
+    def __init__(self, pool, conf=None, single_flight=False):
+        self._pool = pool
+        if conf is None:
+            self.cache = None
+        else:
+            self.cache = QueryCache(
+                conf.get('size', DEFAULT_CACHE_SIZE),
+                conf.get('ttl', DEFAULT_CACHE_TTL),
+                conf.get('collections', None)
+            )
+        self.flights = SingleFlight() if single_flight else None
+
+        for func in WRITE_FUNCTIONS:
+            setattr(self, func, self._wrap_write(func))
+
+    def __getattr__(self, item):
+        return getattr(self._pool, item)
+
+    def _invalidate(self, collection=None):
+        if self.cache:
+            self.cache.invalidate(collection)
+        if self.flights:
+            self.flights.forget(collection)
+
+    def _wrap_write(self, func):
+        def write(*args, **kwargs):
+            # SimpleCollection passes collection as keyword
+            collection = kwargs['collection'] if 'collection' in kwargs else args[0]
+            try:
+                return getattr(self._pool, func)(*args, **kwargs)
+            finally:
+                self._invalidate(collection)
+        return write
+
+    def _cached(self, key, collection, func, *args, **kwargs):
+        if self.cache:
+            found, result = self.cache.get(key)
+            if found:
+                return result
+            version = self.cache.version(collection)
+
+        if self.flights:
+            result = self.flights.do(key, collection, func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+
+        if self.cache:
+            self.cache.put(key, collection, result, version)
+        return result
+
+    def filter(self, collection, filters=None, fields=None,
+               order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        key = (
+            'filter', collection, normalize_filters(filters), freeze(fields),
+            freeze(order_by), limit, normalize_options(kwargs)
+        )
+        return self._cached(
+            key, collection, self._pool.filter,
+            collection, filters, fields, order_by=order_by, limit=limit,
+            **kwargs
+        )
+
+    def get(self, collection, filters=None, fields=None, **kwargs):
+        key = (
+            'get', collection, normalize_filters(filters), freeze(fields),
+            normalize_options(kwargs)
+        )
+        return self._cached(
+            key, collection, self._pool.get,
+            collection, filters, fields, **kwargs
+        )
+
+    def exist(self, collection, filters, **kwargs):
+        key = (
+            'exist', collection, normalize_filters(filters),
+            normalize_options(kwargs)
+        )
+        return self._cached(
+            key, collection, self._pool.exist, collection, filters, **kwargs)
+
+    def get_many(self, collection, keys, key_field='id', fields=None,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE, **kwargs):
+        """
+        rows are cached by key, only keys not cached are requested,
+        so chunks of cached keys are skipped
+        """
+        if not self.cache:
+            return self._pool.get_many(
+                collection, keys, key_field, fields, chunk_size, **kwargs)
+
+        prefix = ('row', collection, key_field, freeze(fields))
+        version = self.cache.version(collection)
+
+        result, missing = {}, []
+        for k in OrderedDict.fromkeys(keys):
+            found, row = self.cache.get(prefix + (k, ))
+            if not found:
+                missing.append(k)
+            elif row is not None:
+                result[k] = row
+
+        if missing:
+            rows = self._pool.get_many(
+                collection, missing, key_field, fields, chunk_size, **kwargs)
+            for k in missing:
+                row = rows.get(k, None)
+                self.cache.put(prefix + (k, ), collection, row, version)
+                if row is not None:
+                    result[k] = row
+        return result
+
+    def execute(self, query, *args, **kwargs):
+        try:
+            return self._pool.execute(query, *args, **kwargs)
+        finally:
+            if not query.lstrip().upper().startswith('SELECT'):
+                self._invalidate()
+
+    def cache_info(self):
+        if self.cache:
+            info = self.cache.info()
+        else:
+            info = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+        info['coalesced'] = self.flights.coalesced if self.flights else 0
+        return info
+
+    def close(self):
+        self._invalidate()
+        self._pool.close()
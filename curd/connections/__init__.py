@@ -1,4 +1,6 @@
+import time
 import logging
+from collections import OrderedDict
 
 from ..errors import ProgrammingError
 
@@ -7,15 +9,147 @@ logger = logging.Logger('curd')
 
 DEFAULT_FILTER_LIMIT = None
 DEFAULT_TIMEOUT = 3600 * 10
+DEFAULT_ITER_SIZE = 1000
+DEFAULT_SCAN_BATCH_SIZE = 1000
+DEFAULT_CREATE_MANY_CHUNK_SIZE = 1000
+DEFAULT_UPDATE_MANY_CHUNK_SIZE = 500
+DEFAULT_DELETE_BATCH_SIZE = 1000
+DEFAULT_GET_MANY_CHUNK_SIZE = 500
+DEFAULT_ASYNC_POOL_SIZE = 10
+DEFAULT_GATHER_WORKERS = 10
 
-CREATE_MODE = ('INSERT', 'IGNORE', 'REPLACE')
+CREATE_MODE = ('INSERT', 'IGNORE', 'REPLACE', 'UPSERT')
 FILTER_OP = ('<', '>', '>=', '<=', '=', '!=', 'IN')
 CURD_FUNCTIONS = (
     'create', 'update', 'get', 'delete', 'filter', 'exist', 'execute', 'create_many'
 )
+ITER_FUNCTIONS = ('iter_filter', 'iter_execute')
+BULK_FUNCTIONS = ('update_many', 'delete_many', 'get_many')
+SESSION_FUNCTIONS = CURD_FUNCTIONS + ITER_FUNCTIONS + BULK_FUNCTIONS + ('scan', )
+# returning concurrent.futures.Future, cassandra only
+ASYNC_FUNCTIONS = (
+    'create_async', 'update_async', 'get_async', 'delete_async',
+    'filter_async', 'exist_async', 'execute_async'
+)
 
 OP_RETRY_WARNING = 'RETRY: {}'
 
+# conf keys consumed by connection pools, never passed to database drivers
+POOL_CONF_KEYS = (
+    'min_size', 'max_size', 'acquire_timeout', 'max_idle_time', 'max_lifetime',
+    'warmup', 'warmup_workers', 'retry'
+)
+
+
+def keyset_scan(filter_func, collection, key='id',
+                batch_size=DEFAULT_SCAN_BATCH_SIZE, filters=None, fields=None,
+                start=None, **kwargs):
+    """
+    iterate over collection ordered by key, page by page with
+    `WHERE key > last ORDER BY key LIMIT batch_size`.
+    key should be unique, pass the key of last processed row as start
+    to resume a scan
+    """
+    filters = list(filters or [])
+    if fields and key not in fields:
+        fields = list(fields) + [key]
+
+    last = start
+    while True:
+        if last is None:
+            page_filters = filters
+        else:
+            page_filters = filters + [('>', key, last)]
+        rows = filter_func(
+            collection, page_filters, fields, order_by=key, limit=batch_size,
+            **kwargs
+        )
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            break
+        last = rows[-1][key]
+
+
+def chunked_delete(filter_func, delete_func, collection, filters=None,
+                   key='id', batch_size=DEFAULT_DELETE_BATCH_SIZE,
+                   max_rate=None, start=None, **kwargs):
+    """
+    delete matched rows chunk by chunk, keys of a chunk are selected with
+    `WHERE key > last ORDER BY key LIMIT batch_size` and deleted with
+    `WHERE key IN (...)`, or `DELETE ... LIMIT batch_size` when key is None.
+    delete_func returns deleted rows, at most max_rate rows are deleted
+    per second. return total deleted rows.
+    deleted rows don't match filters anymore, rerun to resume after failure,
+    start skips keys up to the last deleted one
+    """
+    filters = list(filters or [])
+
+    deleted = 0
+    began = time.monotonic()
+    last = start
+    while True:
+        if key is None:
+            count = delete_func(collection, filters, limit=batch_size, **kwargs)
+            finished = count < batch_size
+        else:
+            if last is None:
+                page_filters = filters
+            else:
+                page_filters = filters + [('>', key, last)]
+            rows = filter_func(
+                collection, page_filters, [key], order_by=key,
+                limit=batch_size, **kwargs
+            )
+            if not rows:
+                break
+            last = rows[-1][key]
+            count = delete_func(
+                collection, [('IN', key, [row[key] for row in rows])], **kwargs)
+            finished = len(rows) < batch_size
+
+        deleted += count
+        if finished:
+            break
+
+        if max_rate:
+            delay = began + deleted / max_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return deleted
+
+
+def key_chunks(keys, chunk_size):
+    """
+    distinct keys in order, split into chunks of chunk_size
+    """
+    keys = list(OrderedDict.fromkeys(keys))
+    if not chunk_size:
+        return [keys] if keys else []
+    return [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+
+def chunked_get(filter_func, collection, keys, key_field='id', fields=None,
+                chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE, map_func=map, **kwargs):
+    """
+    get rows by keys with `WHERE key_field IN (...)` of at most chunk_size
+    keys, a fixed IN-list arity reuses the compiled query.
+    chunks are run through map_func, pass a parallel map to run them
+    concurrently. return {key: row}, keys not found are left out
+    """
+    if fields and key_field not in fields:
+        fields = list(fields) + [key_field]
+
+    def get_chunk(chunk):
+        return filter_func(
+            collection, [('IN', key_field, chunk)], fields, **kwargs)
+
+    result = {}
+    for rows in map_func(get_chunk, key_chunks(keys, chunk_size)):
+        for row in rows:
+            result[row[key_field]] = row
+    return result
+
 
 class BaseConnection(object):
     def _check_filters(self, filters):
@@ -38,13 +172,42 @@ class BaseConnection(object):
     def update(self, collection, data, filters, **kwargs):
         raise NotImplementedError
 
+    def update_many(self, collection, rows, key='id', **kwargs):
+        raise NotImplementedError
+
     def delete(self, collection, filters, **kwargs):
         raise NotImplementedError
+
+    def delete_many(self, collection, filters=None, key='id',
+                    batch_size=DEFAULT_DELETE_BATCH_SIZE, max_rate=None,
+                    start=None, **kwargs):
+        raise NotImplementedError
     
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
         raise NotImplementedError
     
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        raise NotImplementedError
+
+    def iter_execute(self, query, params=None, **kwargs):
+        raise NotImplementedError
+
+    def scan(self, collection, key='id', batch_size=DEFAULT_SCAN_BATCH_SIZE,
+             filters=None, fields=None, start=None, **kwargs):
+        return keyset_scan(
+            self.filter, collection, key, batch_size, filters, fields, start,
+            **kwargs
+        )
+
+    def get_many(self, collection, keys, key_field='id', fields=None,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE, **kwargs):
+        return chunked_get(
+            self.filter, collection, keys, key_field, fields, chunk_size,
+            **kwargs
+        )
+
     def get(self, collection, filters=None, fields=None, **kwargs):
         rows = self.filter(collection, filters, fields, limit=1, **kwargs)
         if rows:
@@ -1,10 +1,17 @@
 import os
+import re
 import copy
 import time
-from threading import RLock
+import asyncio
+from threading import RLock, Lock, Timer
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
 
 from cassandra.auth import PlainTextAuthProvider
 from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement, BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent
 from cassandra import Timeout, OperationTimedOut, InvalidRequest
 
 from ..errors import (
@@ -19,12 +26,50 @@ from .utils.cql import (
     query_parameters_from_delete,
     query_parameters_from_filter,
 )
+from .utils.result import check_result_format, format_result
+from .retry import retry_policy_from_conf
 from . import (
-    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, OP_RETRY_WARNING
+    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, DEFAULT_ITER_SIZE,
+    DEFAULT_GET_MANY_CHUNK_SIZE, OP_RETRY_WARNING, CURD_FUNCTIONS, chunked_get
 )
 
 
 TIME_INTERVAL_TO_ACQUIRE_LOCK = 0.5
+DEFAULT_PREPARED_CACHE_SIZE = 1024
+DEFAULT_CONCURRENCY = 100
+DEFAULT_BATCH_SIZE = 50
+
+
+def map_future(future, func):
+    """
+    future of func(result of future), errors are passed through
+    """
+    new_future = Future()
+
+    def done(f):
+        error = f.exception()
+        if error is not None:
+            new_future.set_exception(error)
+            return
+        try:
+            new_future.set_result(func(f.result()))
+        except Exception as e:
+            new_future.set_exception(e)
+
+    future.add_done_callback(done)
+    return new_future
+
+
+def map_future_results(func, iterable):
+    """
+    map with func returning futures, all are submitted before waiting
+    """
+    futures = [func(i) for i in iterable]
+    return [future.result() for future in futures]
+
+
+# prepared statements may be stale after these
+SCHEMA_CHANGE_RE = re.compile(r'\s*(CREATE|ALTER|DROP)\s', re.IGNORECASE)
 
 
 class CassandraConnectionPool(BaseConnection):
@@ -36,8 +81,15 @@ class CassandraConnectionPool(BaseConnection):
 
         self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
         self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
+        self.concurrency = conf.get('concurrency', DEFAULT_CONCURRENCY)
+        self.retry_policy = retry_policy_from_conf(conf)
 
         self.cluster_init_lock = RLock()
+
+        self.prepared_cache_size = conf.get(
+            'prepared_cache_size', DEFAULT_PREPARED_CACHE_SIZE)
+        self._prepared = OrderedDict()
+        self._prepared_lock = Lock()
         
     def _connect(self, conf):
         conf = copy.deepcopy(conf)
@@ -74,6 +126,12 @@ class CassandraConnectionPool(BaseConnection):
             else:
                 time.sleep(TIME_INTERVAL_TO_ACQUIRE_LOCK)
 
+    def retry_info(self):
+        """
+        see MysqlConnectionPool.retry_info
+        """
+        return self.retry_policy.info()
+
     def close(self):
         if self.session:
             try:
@@ -87,76 +145,458 @@ class CassandraConnectionPool(BaseConnection):
                 logger.warning(str(e))
 
         self.cluster, self.session = None, None
-        
-    def _execute(self, query, params, **kwargs):
+        self.clear_prepared()
+
+    def clear_prepared(self):
+        with self._prepared_lock:
+            self._prepared = OrderedDict()
+
+    def _prepare(self, query):
+        with self._prepared_lock:
+            statement = self._prepared.get(query, None)
+            if statement is not None:
+                self._prepared.move_to_end(query)
+                return statement
+
+        statement = self.session.prepare(query)
+
+        with self._prepared_lock:
+            self._prepared[query] = statement
+            while len(self._prepared) > self.prepared_cache_size:
+                self._prepared.popitem(last=False)
+        return statement
+
+    def _forget_prepared(self, query):
+        with self._prepared_lock:
+            self._prepared.pop(query, None)
+
+    def _wrap_error(self, e):
+        if isinstance(e, (Timeout, OperationTimedOut)):
+            return OperationFailure(origin_error=e)
+        elif isinstance(e, InvalidRequest):
+            return ProgrammingError(origin_error=e)
+        else:
+            return UnexpectedError(origin_error=e)
+
+    def _execute(self, query, params, prepared=False, **kwargs):
         if not self.session:
             self.connect(self._conf)
         
         try:
-            result = list(self.session.execute(query, params, **kwargs))
-        except (Timeout, OperationTimedOut) as e:
-            raise OperationFailure(origin_error=e)
-        except InvalidRequest as e:
-            raise ProgrammingError(origin_error=e)
+            statement = self._prepare(query) if prepared else query
+            result = self.session.execute(statement, params, **kwargs)
+            rows = list(result)
         except Exception as e:
-            raise UnexpectedError(origin_error=e)
+            if prepared and isinstance(e, InvalidRequest):
+                # may be stale after schema change, prepare again next time
+                self._forget_prepared(query)
+            raise self._wrap_error(e)
         else:
-            return result
-        
-    def execute(self, query, params=None, retry=None, timeout=None):
+            if not prepared and SCHEMA_CHANGE_RE.match(query):
+                self.clear_prepared()
+            # field names of rows, column names of empty result
+            columns = rows[0]._fields if rows else result.column_names or []
+            return columns, rows
+
+    def _check_pid(self):
         if os.getpid() != self.pid:
             self.close()
             self.pid = os.getpid()
 
-        if retry is None:
-            retry = self.max_op_fail_retry
-            
-        if timeout is None:
-            timeout = self.default_timeout
-
-        retry_no = 0
+    def _call_with_retry(self, func, retry, *args, **kwargs):
+        self.retry_policy.request()
+        retry_no, total_delay = 0, 0
         while True:
             try:
-                rows = self._execute(query, params, timeout=timeout)
+                return func(*args, **kwargs)
             except OperationFailure as e:
                 # self.close()
-                if retry_no < retry:
-                    logger.warning(OP_RETRY_WARNING.format(str(e)))
-                    retry_no += 1
-                else:
+                delay = self.retry_policy.backoff(retry_no, total_delay, retry)
+                if delay is None:
                     raise
+                logger.warning(OP_RETRY_WARNING.format(str(e)))
+                time.sleep(delay)
+                retry_no += 1
+                total_delay += delay
             except ProgrammingError:
                     raise
             except (UnexpectedError, Exception, KeyboardInterrupt):
                 self.close()
                 raise
+
+    def execute(self, query, params=None, retry=None, timeout=None,
+                prepared=False, result_format=None):
+        """
+        prepared query uses `?` markers and is prepared once,
+        statements are cached by query.
+        result_format as MysqlConnection.execute, tuples are driver rows
+        """
+        self._check_pid()
+        result_format = check_result_format(result_format)
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+            
+        if timeout is None:
+            timeout = self.default_timeout
+
+        columns, rows = self._call_with_retry(
+            self._execute, retry, query, params, prepared, timeout=timeout)
+        if result_format == 'dicts':
+            return [row._asdict() for row in rows]
+        return format_result(columns, rows, result_format)
+
+    def _execute_paged(self, query, params, fetch_size, prepared=False,
+                       **kwargs):
+        if not self.session:
+            self.connect(self._conf)
+
+        try:
+            if prepared:
+                statement = self._prepare(query).bind(params)
+                statement.fetch_size = fetch_size
+                params = None
             else:
-                return [row._asdict() for row in rows]
+                statement = SimpleStatement(query, fetch_size=fetch_size)
+            return self.session.execute(statement, params, **kwargs)
+        except Exception as e:
+            if prepared and isinstance(e, InvalidRequest):
+                self._forget_prepared(query)
+            raise self._wrap_error(e)
+
+    def iter_execute(self, query, params=None, retry=None, timeout=None,
+                     chunk_size=None, prepared=False):
+        """
+        stream rows page by page with driver paging,
+        yield lists of chunk_size rows if chunk_size is given
+        """
+        self._check_pid()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        result = self._call_with_retry(
+            self._execute_paged, retry, query, params,
+            chunk_size or DEFAULT_ITER_SIZE, prepared, timeout=timeout)
+
+        rows = []
+        try:
+            for row in result:
+                if chunk_size:
+                    rows.append(row._asdict())
+                    if len(rows) >= chunk_size:
+                        yield rows
+                        rows = []
+                else:
+                    yield row._asdict()
+        except Exception as e:
+            raise self._wrap_error(e)
+        if rows:
+            yield rows
         
     def create(self, collection, data, mode='INSERT', **kwargs):
         query, params = query_parameters_from_create(
             collection, data, mode.upper())
-        rows = self.execute(query, params, **kwargs)
+        rows = self.execute(query, params, prepared=True, **kwargs)
         if rows and mode.upper() != 'IGNORE' and not rows[0].get('applied', True):
             raise DuplicateKeyError
 
-    def create_many(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
-        raise NotImplementedError('not supported')
+    def _partition_key(self, collection):
+        keyspace, _, table = collection.rpartition('.')
+        keyspace = keyspace or self.session.keyspace
+        try:
+            table_meta = self.cluster.metadata.keyspaces[
+                keyspace.strip('"')].tables[table.strip('"')]
+        except (KeyError, AttributeError):
+            return None
+        return [column.name for column in table_meta.partition_key]
+
+    def _create_many_units(self, collection, data, indexes, mode, batch_size):
+        """
+        (statement, params, row indexes) to execute, rows with the same
+        partition key are grouped into UNLOGGED batches, which is one mutation
+        on one replica set. INSERT/IGNORE use lightweight transaction
+        `IF NOT EXISTS`, these rows are sent one by one
+        """
+        groups = OrderedDict()
+        partition_key = self._partition_key(collection)
+        for index in indexes:
+            query, params = query_parameters_from_create(
+                collection, data[index], mode)
+            if mode in ('REPLACE', 'UPSERT') and partition_key and \
+                    all(k in data[index] for k in partition_key):
+                key = (query, tuple(data[index][k] for k in partition_key))
+            else:
+                key = (query, index)
+            groups.setdefault(key, []).append((index, params))
+
+        units = []
+        for (query, _), rows in groups.items():
+            statement = self._prepare(query)
+            for i in range(0, len(rows), batch_size):
+                chunk = rows[i:i + batch_size]
+                if len(chunk) == 1:
+                    index, params = chunk[0]
+                    units.append((statement, params, [index]))
+                    continue
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for _, params in chunk:
+                    batch.add(statement, params)
+                units.append((batch, None, [index for index, _ in chunk]))
+        return units
+
+    def create_many(self, collection, data, mode='INSERT', compress_fields=None,
+                    concurrency=None, batch_size=DEFAULT_BATCH_SIZE, retry=None,
+                    **kwargs):
+        """
+        create rows concurrently, at most concurrency requests in flight.
+        rows failed with OperationFailure are retried together after backoff
+        of retry policy, other failures
+        don't abort the rest, return them as [(index of row, error), ...],
+        row existed in INSERT mode fails with DuplicateKeyError
+        """
+        self._check_pid()
+
+        if not isinstance(data, list):
+            data = [data, ]
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if concurrency is None:
+            concurrency = self.concurrency
+
+        mode = mode.upper()
+        if not self.session:
+            self.connect(self._conf)
+
+        self.retry_policy.request()
+        failures = {}
+        indexes = list(range(len(data)))
+        retry_no, total_delay = 0, 0
+        while indexes:
+            try:
+                units = self._create_many_units(
+                    collection, data, indexes, mode, batch_size)
+            except Exception as e:
+                raise self._wrap_error(e)
+
+            results = execute_concurrent(
+                self.session, [(st, params) for st, params, _ in units],
+                concurrency=concurrency, raise_on_first_error=False
+            )
+
+            retry_errors = {}
+            for (_, _, unit_indexes), (success, result) in zip(units, results):
+                if success:
+                    if mode == 'INSERT':
+                        row = next(iter(result), None)
+                        if row is not None and \
+                                not row._asdict().get('applied', True):
+                            failures[unit_indexes[0]] = DuplicateKeyError()
+                    continue
+
+                error = self._wrap_error(result)
+                if isinstance(error, OperationFailure):
+                    retry_errors.update((index, error) for index in unit_indexes)
+                else:
+                    for index in unit_indexes:
+                        failures[index] = error
+
+            if not retry_errors:
+                break
+            delay = self.retry_policy.backoff(retry_no, total_delay, retry)
+            if delay is None:
+                failures.update(retry_errors)
+                break
+
+            logger.warning(OP_RETRY_WARNING.format(
+                '{} rows of create_many'.format(len(retry_errors))))
+            time.sleep(delay)
+            indexes = sorted(retry_errors)
+            retry_no += 1
+            total_delay += delay
+
+        return sorted(failures.items())
 
     def update(self, collection, data, filters, **kwargs):
         filters = self._check_filters(filters)
         query, params = query_parameters_from_update(collection, filters, data)
-        self.execute(query, params, **kwargs)
+        self.execute(query, params, prepared=True, **kwargs)
         
     def delete(self, collection, filters, **kwargs):
         filters = self._check_filters(filters)
         query, params = query_parameters_from_delete(collection, filters)
-        self.execute(query, params, **kwargs)
+        self.execute(query, params, prepared=True, **kwargs)
         
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
         filters = self._check_filters(filters)
         query, params = query_parameters_from_filter(
             collection, filters, fields, order_by, limit)
-        rows = self.execute(query, params, **kwargs)
+        rows = self.execute(query, params, prepared=True, **kwargs)
         return rows
+
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        return self.iter_execute(query, params, prepared=True, **kwargs)
+
+    def get_many(self, collection, keys, key_field='id', fields=None,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE, **kwargs):
+        """
+        chunks are requested concurrently, see chunked_get
+        """
+        return chunked_get(
+            self.filter_async, collection, keys, key_field, fields,
+            chunk_size, map_future_results, **kwargs
+        )
+
+    def _execute_async(self, future, query, params, retry, timeout, prepared,
+                       retry_no=0, total_delay=0):
+        rows = []
+
+        def on_error(e):
+            if prepared and isinstance(e, InvalidRequest):
+                self._forget_prepared(query)
+            error = self._wrap_error(e)
+            delay = None
+            if isinstance(error, OperationFailure):
+                delay = self.retry_policy.backoff(retry_no, total_delay, retry)
+            if delay is None:
+                future.set_exception(error)
+                return
+
+            logger.warning(OP_RETRY_WARNING.format(str(error)))
+            # callbacks run in driver event loop, never sleep in it
+            timer = Timer(
+                delay, self._execute_async,
+                (future, query, params, retry, timeout, prepared,
+                 retry_no + 1, total_delay + delay)
+            )
+            timer.daemon = True
+            timer.start()
+
+        def on_page(page):
+            rows.extend(page)
+            if response_future.has_more_pages:
+                response_future.start_fetching_next_page()
+            else:
+                future.set_result([row._asdict() for row in rows])
+
+        try:
+            if not self.session:
+                self.connect(self._conf)
+            statement = self._prepare(query) if prepared else query
+            response_future = self.session.execute_async(
+                statement, params, timeout=timeout)
+        except Exception as e:
+            on_error(e)
+        else:
+            response_future.add_callbacks(on_page, on_error)
+
+    def execute_async(self, query, params=None, retry=None, timeout=None,
+                      prepared=False):
+        """
+        return concurrent.futures.Future of rows like execute,
+        errors and retries are the same as execute,
+        use asyncio.wrap_future to await it
+        """
+        self._check_pid()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        future = Future()
+        self.retry_policy.request()
+        self._execute_async(future, query, params, retry, timeout, prepared)
+        return future
+
+    def create_async(self, collection, data, mode='INSERT', **kwargs):
+        query, params = query_parameters_from_create(
+            collection, data, mode.upper())
+
+        def check_applied(rows):
+            if rows and mode.upper() != 'IGNORE' and not rows[0].get('applied', True):
+                raise DuplicateKeyError
+
+        return map_future(
+            self.execute_async(query, params, prepared=True, **kwargs),
+            check_applied
+        )
+
+    def update_async(self, collection, data, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_update(collection, filters, data)
+        return map_future(
+            self.execute_async(query, params, prepared=True, **kwargs),
+            lambda rows: None
+        )
+
+    def delete_async(self, collection, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_delete(collection, filters)
+        return map_future(
+            self.execute_async(query, params, prepared=True, **kwargs),
+            lambda rows: None
+        )
+
+    def filter_async(self, collection, filters=None, fields=None,
+                     order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        return self.execute_async(query, params, prepared=True, **kwargs)
+
+    def get_async(self, collection, filters=None, fields=None, **kwargs):
+        return map_future(
+            self.filter_async(collection, filters, fields, limit=1, **kwargs),
+            lambda rows: rows[0] if rows else None
+        )
+
+    def exist_async(self, collection, filters, **kwargs):
+        if not filters:
+            raise ProgrammingError('exist without filter is not supported')
+        fields = [filters[0][1]]
+        return map_future(
+            self.get_async(collection, filters, fields=fields, **kwargs),
+            lambda row: bool(row)
+        )
+
+
+class AsyncCassandraConnectionPool(object):
+    """
+    asyncio facade of CassandraConnectionPool on top of its futures API,
+    at most `concurrency` requests in flight. create_many blocks on
+    concurrent execution already, it runs in default executor
+    """
+
+    def __init__(self, conf):
+        self._pool = CassandraConnectionPool(conf)
+        # created in running loop
+        self._semaphore = None
+
+        for func in CURD_FUNCTIONS:
+            setattr(self, func, partial(self._wrap_func, func))
+
+    async def _wrap_func(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._pool.concurrency)
+
+        async with self._semaphore:
+            if func == 'create_many':
+                return await asyncio.get_event_loop().run_in_executor(
+                    None, partial(self._pool.create_many, *args, **kwargs))
+            future = getattr(self._pool, func + '_async')(*args, **kwargs)
+            return await asyncio.wrap_future(future)
+
+    async def close(self):
+        self._pool.close()
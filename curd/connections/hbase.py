@@ -1,9 +1,15 @@
+import os
 import copy
-import random
+import time
+import asyncio
+import itertools
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import phoenixdb
 from . import logger
 from ..errors import (
-    UnexpectedError, OperationFailure, ProgrammingError,
+    Error, UnexpectedError, OperationFailure, ProgrammingError,
     ConnectError,
     DuplicateKeyError
 )
@@ -11,19 +17,173 @@ from .utils.sql import (
     query_parameters_from_create,
     query_parameters_from_update,
     query_parameters_from_delete,
-    query_parameters_from_filter
+    query_parameters_from_filter,
+    query_parameters_from_create_many,
+    is_column_data
 )
+from .utils.result import cursor_columns, format_result
 from . import (
-    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, OP_RETRY_WARNING,
+    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, DEFAULT_ITER_SIZE,
+    DEFAULT_ASYNC_POOL_SIZE, DEFAULT_CREATE_MANY_CHUNK_SIZE, OP_RETRY_WARNING,
     CURD_FUNCTIONS
 )
 from .mysql import MysqlConnection, MysqlConnectionPool
 
 
+BALANCE_MODES = ('least_in_flight', 'least_latency')
+DEFAULT_URL_BACKOFF = 1
+DEFAULT_MAX_URL_BACKOFF = 60
+# weight of the last operation in average latency
+LATENCY_DECAY = 0.3
+
+
+class UrlBalancer(object):
+    """
+    health and load of phoenix query server urls, shared by connections
+    of a pool. a url is marked down on connect error or OperationFailure,
+    after backoff (doubled on each failure, up to max_backoff) one
+    connection probes it, success marks it up again, and closing the probe
+    connection before it ends an operation lets another one probe.
+    healthy urls are chosen by
+        least_in_flight: fewest running operations, then fewest connections,
+            so pooled connections are spread over urls
+        least_latency: lowest average operation latency, then fewest
+            connections
+    """
+
+    def __init__(self, urls, balance='least_in_flight',
+                 backoff=DEFAULT_URL_BACKOFF, max_backoff=DEFAULT_MAX_URL_BACKOFF):
+        if balance not in BALANCE_MODES:
+            raise ProgrammingError('not supported balance {}'.format(balance))
+
+        self.urls = list(urls)
+        self.balance = balance
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._probe_ids = itertools.count(1)
+        self._connections = dict.fromkeys(self.urls, 0)
+        self._in_flight = dict.fromkeys(self.urls, 0)
+        self._latency = dict.fromkeys(self.urls, None)
+        self._failures = dict.fromkeys(self.urls, 0)
+        self._down_until = dict.fromkeys(self.urls, 0)
+        self._probing = {}  # url: probe id of the connection probing it
+
+    def _check_pid(self):
+        # before taking lock, which may be held by a thread of parent process
+        if os.getpid() != self.pid:
+            # connections of parent process are dropped without release
+            self._reset()
+
+    def _choose(self, now):
+        for url in self.urls:
+            if self._failures[url] and self._down_until[url] <= now and \
+                    url not in self._probing:
+                probe = next(self._probe_ids)
+                self._probing[url] = probe
+                return url, probe
+
+        healthy = [url for url in self.urls if not self._failures[url]]
+        if not healthy:
+            # all down, try the one which comes back first
+            url = min(self.urls, key=self._down_until.__getitem__)
+        elif self.balance == 'least_latency':
+            url = min(healthy, key=lambda url: (
+                self._latency[url] or 0, self._connections[url]))
+        else:
+            url = min(healthy, key=lambda url: (
+                self._in_flight[url], self._connections[url]))
+        return url, None
+
+    def acquire(self):
+        """
+        url for a new connection and its probe id, None if it is not
+        the probe of a down url, both are passed to release
+        """
+        self._check_pid()
+        with self._lock:
+            url, probe = self._choose(time.monotonic())
+            self._connections[url] += 1
+            return url, probe
+
+    def release(self, url, probe=None):
+        self._check_pid()
+        with self._lock:
+            if self._connections[url] > 0:
+                self._connections[url] -= 1
+            if probe is not None and self._probing.get(url) == probe:
+                # probe connection closed before any operation, probe again
+                del self._probing[url]
+
+    def begin(self, url):
+        self._check_pid()
+        with self._lock:
+            self._in_flight[url] += 1
+
+    def end(self, url, latency=None, failed=False):
+        self._check_pid()
+        with self._lock:
+            if self._in_flight[url] > 0:
+                self._in_flight[url] -= 1
+            if failed:
+                self._mark_down(url)
+            elif latency is not None:
+                self._mark_up(url, latency)
+
+    def mark_down(self, url):
+        self._check_pid()
+        with self._lock:
+            self._mark_down(url)
+
+    def _mark_down(self, url):
+        self._failures[url] += 1
+        delay = min(
+            self.backoff * 2 ** (self._failures[url] - 1), self.max_backoff)
+        self._down_until[url] = time.monotonic() + delay
+        self._probing.pop(url, None)
+        logger.warning('HBASE URL DOWN: {} for {}s'.format(url, delay))
+
+    def _mark_up(self, url, latency):
+        self._failures[url] = 0
+        self._probing.pop(url, None)
+        if self._latency[url] is None:
+            self._latency[url] = latency
+        else:
+            self._latency[url] += LATENCY_DECAY * (latency - self._latency[url])
+
+    def status(self):
+        self._check_pid()
+        with self._lock:
+            now = time.monotonic()
+            return dict((url, {
+                'healthy': not self._failures[url],
+                'down_for': max(self._down_until[url] - now, 0) if self._failures[url] else 0,
+                'connections': self._connections[url],
+                'in_flight': self._in_flight[url],
+                'latency': self._latency[url]
+            }) for url in self.urls)
+
+
+def url_balancer_from_conf(conf):
+    return UrlBalancer(
+        conf['urls'],
+        conf.get('balance', 'least_in_flight'),
+        conf.get('url_backoff', DEFAULT_URL_BACKOFF),
+        conf.get('max_url_backoff', DEFAULT_MAX_URL_BACKOFF)
+    )
+
+
 class HbaseConnection(MysqlConnection):
 
-    def __init__(self, conf):
-        MysqlConnection.__init__(self, conf)
+    def __init__(self, conf, urls=None, retry_policy=None):
+        MysqlConnection.__init__(self, conf, retry_policy)
+        self.urls = urls or url_balancer_from_conf(conf)
+        self.url, self.probe = None, None
 
     def _connect(self, conf):
         conf = copy.deepcopy(conf)
@@ -31,11 +191,39 @@ class HbaseConnection(MysqlConnection):
         self.max_op_fail_retry = conf.pop('max_op_fail_retry', 0)
         self.default_timeout = conf.pop('timeout', DEFAULT_TIMEOUT)
 
-        conn = phoenixdb.connect(random.choice(conf['urls']), autocommit=True)
-        cursor = conn.cursor(cursor_factory=phoenixdb.cursor.DictCursor)
+        url, probe = self.urls.acquire()
+        try:
+            conn = phoenixdb.connect(url, autocommit=True)
+            cursor = conn.cursor(cursor_factory=phoenixdb.cursor.DictCursor)
+        except Exception:
+            self.urls.release(url, probe)
+            self.urls.mark_down(url)
+            raise
+        self.url, self.probe = url, probe
         return conn, cursor
 
-    def _execute(self, query, params, timeout, cursor_func='execute'):
+    def close(self):
+        MysqlConnection.close(self)
+        if self.url:
+            self.urls.release(self.url, self.probe)
+            self.url, self.probe = None, None
+
+    def ping(self):
+        # phoenix connection is opened on query server when connecting
+        if not self.cursor:
+            self.connect(self._conf)
+
+    def _wrap_error(self, e):
+        errs = phoenixdb.errors
+        if isinstance(e, errs.ProgrammingError):
+            return ProgrammingError(origin_error=e)
+        elif any(map(lambda x: isinstance(e, x), [errs.InternalError, errs.OperationalError])):
+            return OperationFailure(origin_error=e)  # will retry
+        else:
+            return UnexpectedError(origin_error=e)
+
+    def _execute(self, query, params, timeout, cursor_func='execute',
+                 result_format='dicts'):
         # 直接写的upsert，为保证成功，重建连接
         is_raw_upsert = query.upper().strip().startswith('UPSERT') and params is None  #  直接用sql的插入更新
         if is_raw_upsert:
@@ -45,19 +233,46 @@ class HbaseConnection(MysqlConnection):
         if not self.cursor:
             self.connect(self._conf)
 
+        url, began = self.url, time.monotonic()
+        self.urls.begin(url)
+        try:
+            rows = self._execute_query(
+                query, params, timeout, cursor_func, result_format)
+        except OperationFailure:
+            self.urls.end(url, failed=True)
+            raise
+        except Exception:
+            # query server answered
+            self.urls.end(url, time.monotonic() - began)
+            raise
+        else:
+            self.urls.end(url, time.monotonic() - began)
+            return rows
+
+    def _execute_query(self, query, params, timeout, cursor_func='execute',
+                       result_format='dicts'):
         self.conn._read_timeout = timeout
         self.conn._write_timeout = timeout
 
+        if cursor_func == 'executemany':
+            # phoenixdb 0.7 prepares once and executes row by row,
+            # rows are committed one by one in autocommit mode
+            try:
+                self.cursor.executemany(query, params)
+            except Exception as e:
+                raise self._wrap_error(e)
+            return None
+
+        if result_format == 'dicts':
+            cursor = self.cursor
+        else:
+            # rows as lists, no dict per row
+            cursor = self.conn.cursor()
+
         try:
-            self.cursor.execute(query, params)
-        except phoenixdb.errors.ProgrammingError as e:
-            raise ProgrammingError(origin_error=e)
+            cursor.execute(query, params)
         except Exception as e:
-            errs = phoenixdb.errors
-            if any(map(lambda x: isinstance(e, x), [errs.InternalError, errs.OperationalError])):
-                raise OperationFailure(origin_error=e)  # will retry
-            else:
-                raise UnexpectedError(origin_error=e)
+            raise self._wrap_error(e)
         else:
             try:
                 should_have_return = query.upper().strip().startswith('SELECT')
@@ -67,16 +282,45 @@ class HbaseConnection(MysqlConnection):
                 # 此时需要新建conn并重试，因此抛OperationFailure.
                 # 3. upsert的问题已在本函数头通过暴力重连解决. upsert时正常结束和失败结果frame都是None
                 # TODO 此处办法只是规避，要解决根本问题得弄清为何avatica服务端已经timeout还会返回http 200
-                if self.cursor._frame is not None or should_have_return:  # 有返回的语句, 返回结果是空，frame也不应是None
-                    return list(self.cursor.fetchall())
+                if cursor._frame is not None or should_have_return:  # 有返回的语句, 返回结果是空，frame也不应是None
+                    if cursor is self.cursor:
+                        return list(cursor.fetchall())
+                    columns, rows = cursor_columns(cursor), list(cursor.fetchall())
+                    return format_result(columns, rows, result_format)
             except phoenixdb.errors.ProgrammingError as e:
                 raise OperationFailure(origin_error=e)
+        finally:
+            if cursor is not self.cursor:
+                cursor.close()
+
+    def _execute_unbuffered(self, query, params, timeout):
+        if not self.cursor:
+            self.connect(self._conf)
+
+        # rows are fetched from query server frame by frame
+        cursor = self.conn.cursor(cursor_factory=phoenixdb.cursor.DictCursor)
+        cursor.itersize = DEFAULT_ITER_SIZE
+        try:
+            cursor.execute(query, params)
+        except Exception as e:
+            raise self._wrap_error(e)
+        return cursor
 
-    def create(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
+    def _close_unbuffered(self, cursor, finished):
+        try:
+            cursor.close()
+        except Exception as e:
+            logger.warning(str(e))
+
+    def create(self, collection, data, mode='INSERT', compress_fields=None,
+               update_fields=None, increment_fields=None, **kwargs):
+        if update_fields is not None or increment_fields is not None:
+            raise ProgrammingError(
+                'hbase UPSERT overwrites all data fields, '
+                'update_fields/increment_fields are not supported')
         query, params = query_parameters_from_create(
-            collection, data, mode.upper(), compress_fields
+            collection, data, mode.upper(), compress_fields, dialect='phoenix'
         )
-        query = self.adapt_standard_query(query)
         try:
             self.execute(query, params, **kwargs)
         except ProgrammingError as e:
@@ -85,47 +329,120 @@ class HbaseConnection(MysqlConnection):
             else:
                 raise
 
-    def create_many(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
-        raise NotImplementedError('not supported')
+    def create_many(self, collection, data, mode='INSERT', compress_fields=None,
+                    chunk_size=DEFAULT_CREATE_MANY_CHUNK_SIZE,
+                    raise_on_error=True, columns=None,
+                    update_fields=None, increment_fields=None, **kwargs):
+        """
+        data as mysql create_many. each chunk of chunk_size rows prepares the
+        UPSERT once and executes it row by row (phoenixdb 0.7 has no batch),
+        one round trip per row plus one per chunk. rows are committed one by
+        one, a chunk is retried as a whole on OperationFailure
+        (max_op_fail_retry, or retry), UPSERT of sent rows again is harmless.
+        return status of each chunk, phoenix doesn't count affected rows,
+        affected_rows is rows sent
+            {'rows': 1000, 'affected_rows': 1000, 'error': None}
+        """
+        if update_fields is not None or increment_fields is not None:
+            raise ProgrammingError(
+                'hbase UPSERT overwrites all data fields, '
+                'update_fields/increment_fields are not supported')
+        if not isinstance(data, list) and not is_column_data(data):
+            data = [data, ]
+
+        query, rows = query_parameters_from_create_many(
+            collection, data, mode.upper(), compress_fields, columns,
+            dialect='phoenix')
+        if not rows:
+            return []
+
+        status = []
+        for i in range(0, len(rows), chunk_size or len(rows)):
+            chunk = rows[i:i + chunk_size] if chunk_size else rows
+            try:
+                self.execute(query, chunk, cursor_func='executemany', **kwargs)
+            except Error as e:
+                if raise_on_error:
+                    raise
+                status.append(
+                    {'rows': len(chunk), 'affected_rows': 0, 'error': e})
+            else:
+                status.append(
+                    {'rows': len(chunk), 'affected_rows': len(chunk), 'error': None})
+        return status
 
     def update(self, collection, data, filters, **kwargs):
         raise phoenixdb.errors.NotSupportedError(
             'hbase do not support update, use create with insert/replace mode instead')
 
-    def delete(self, collection, filters, **kwargs):
+    def update_many(self, collection, rows, key='id', **kwargs):
+        raise phoenixdb.errors.NotSupportedError(
+            'hbase do not support update, use create with insert/replace mode instead')
+
+    def delete(self, collection, filters, limit=None, **kwargs):
         filters = self._check_filters(filters)
-        query, params = query_parameters_from_delete(collection, filters)
-        query = self.adapt_standard_query(query)
+        query, params = query_parameters_from_delete(
+            collection, filters, limit, dialect='phoenix')
         self.execute(query, params, **kwargs)
+        return self.cursor.rowcount
 
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
         filters = self._check_filters(filters)
         query, params = query_parameters_from_filter(
-            collection, filters, fields, order_by, limit)
-        query = self.adapt_standard_query(query)
+            collection, filters, fields, order_by, limit, dialect='phoenix')
         rows = self.execute(query, params, **kwargs)
         return rows
 
-    @staticmethod
-    def adapt_standard_query(query):
-        """ phoenix sql do not support all standards, hack for quick implement
-            1. '`' quote not support
-            2. UPSERT instead of INSERT
-            3. UPSERT instead of INSERT IGNORE
-            4. UPSERT instead of REPLACE
-            5. '?' instead of '%s'
-        """
-        new_query = query.replace('`', '"').replace('%s', '?') \
-            .replace('REPLACE INTO', 'UPSERT INTO').replace('INSERT INTO', 'UPSERT INTO')
-        if 'INSERT IGNORE INTO' in new_query:
-            new_query = new_query.replace('INSERT IGNORE INTO', 'UPSERT INTO') + ' ON DUPLICATE KEY IGNORE'
-        return new_query
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit, dialect='phoenix')
+        return self.iter_execute(query, params, **kwargs)
 
 
 class HbaseConnectionPool(MysqlConnectionPool):
-    def __init__(self, *args, **kwargs):
-        MysqlConnectionPool.__init__(self, *args, **kwargs)
+    """
+    pool options of MysqlConnectionPool, and url options, all optional
+        balance: least_in_flight (default) or least_latency
+        url_backoff: seconds a failed url is down, doubled on each failure
+        max_url_backoff: max seconds a failed url is down
+    see UrlBalancer
+    """
+
+    def __init__(self, conf):
+        self.urls = url_balancer_from_conf(conf)
+        MysqlConnectionPool.__init__(self, conf)
 
     def get_connection(self):
-        return HbaseConnection(*self._args, **self._kwargs)
+        return HbaseConnection(self._conf, self.urls, self.retry_policy)
+
+    def url_status(self):
+        return self.urls.status()
+
+    def update_many(self, collection, rows, key='id', **kwargs):
+        return self._wrap_func('update_many', collection, rows, key, **kwargs)
+
+
+class AsyncHbaseConnectionPool(object):
+    """
+    asyncio facade of HbaseConnectionPool, phoenixdb has no asyncio driver,
+    operations run in a thread pool as large as the connection pool
+    """
+
+    def __init__(self, conf):
+        self._pool = HbaseConnectionPool(conf)
+        self._executor = ThreadPoolExecutor(
+            self._pool.max_size or DEFAULT_ASYNC_POOL_SIZE)
+
+        for func in CURD_FUNCTIONS:
+            setattr(self, func, partial(self._wrap_func, func))
+
+    async def _wrap_func(self, func, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, partial(getattr(self._pool, func), *args, **kwargs))
+
+    async def close(self):
+        self._pool.close()
+        self._executor.shutdown(wait=False)
@@ -1,13 +1,18 @@
 import os
 import copy
-import queue
+import time
+import weakref
+import threading
+import itertools
 from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import pymysql
 
 from ..errors import (
-    UnexpectedError, OperationFailure, ProgrammingError,
-    ConnectError,
+    Error, UnexpectedError, OperationFailure, ProgrammingError,
+    ConnectError, PoolTimeout,
     DuplicateKeyError
 )
 from . import logger
@@ -16,10 +21,18 @@ from .utils.sql import (
     query_parameters_from_update,
     query_parameters_from_delete,
     query_parameters_from_filter,
-    query_parameters_from_create_many)
+    query_parameters_from_create_chunks,
+    query_parameters_from_update_chunks,
+    is_column_data)
+from .utils.result import check_result_format, cursor_columns, format_result
+from .retry import retry_policy_from_conf, merge_retry_info
 from . import (
-    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, OP_RETRY_WARNING,
-    CURD_FUNCTIONS
+    BaseConnection, DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, DEFAULT_ITER_SIZE,
+    DEFAULT_SCAN_BATCH_SIZE, DEFAULT_CREATE_MANY_CHUNK_SIZE,
+    DEFAULT_UPDATE_MANY_CHUNK_SIZE, DEFAULT_DELETE_BATCH_SIZE,
+    DEFAULT_GET_MANY_CHUNK_SIZE, OP_RETRY_WARNING,
+    CURD_FUNCTIONS, ITER_FUNCTIONS, BULK_FUNCTIONS, POOL_CONF_KEYS,
+    keyset_scan, chunked_delete, chunked_get
 )
 
 # https://www.briandunning.com/error-codes/?source=MySQL
@@ -47,6 +60,9 @@ OF_TIDB_ERROR_CODE_LIST = OF_MYSQL_ERROR_CODE_LIST + \
 OF_TIDB_RETRY_ERROR_CODE_LIST = OF_MYSQL_RETRY_ERROR_CODE_LIST + \
                                 TIDB_ADDITION_ERROR_CODE_LIST
 
+# part of max_allowed_packet used by multi-row create, size is estimated
+PACKET_SIZE_RATIO = 0.9
+
 
 class MysqlConnection(BaseConnection):
     pe_mysql_error_code_list = PE_MYSQL_ERROR_CODE_LIST
@@ -55,11 +71,14 @@ class MysqlConnection(BaseConnection):
     of_mysql_error_code_list = OF_MYSQL_ERROR_CODE_LIST
     of_mysql_retry_error_code_list = OF_MYSQL_RETRY_ERROR_CODE_LIST
 
-    def __init__(self, conf):
+    def __init__(self, conf, retry_policy=None):
         self._conf = conf
         self.pid = os.getpid()
         self.conn, self.cursor = None, None
+        self.connected_at = None
+        self._max_packet_size = None
 
+        self.retry_policy = retry_policy or retry_policy_from_conf(conf)
         self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
         self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
 
@@ -68,6 +87,8 @@ class MysqlConnection(BaseConnection):
 
         self.max_op_fail_retry = conf.pop('max_op_fail_retry', 0)
         self.default_timeout = conf.pop('timeout', DEFAULT_TIMEOUT)
+        for key in POOL_CONF_KEYS:
+            conf.pop(key, None)
 
         conf['use_unicode'] = True
         conf['charset'] = 'utf8mb4'
@@ -90,6 +111,16 @@ class MysqlConnection(BaseConnection):
             self.conn, self.cursor = self._connect(conf)
         except Exception as e:
             raise ConnectError(origin_error=e)
+        self.connected_at = time.monotonic()
+
+    def ping(self):
+        if not self.cursor:
+            self.connect(self._conf)
+        try:
+            self.conn.ping(reconnect=False)
+        except Exception as e:
+            self.close()
+            raise OperationFailure(origin_error=e)
 
     def close(self):
         if self.cursor:
@@ -105,68 +136,165 @@ class MysqlConnection(BaseConnection):
                 logger.warning(str(e))
 
         self.conn, self.cursor = None, None
+        self.connected_at = None
+        self._max_packet_size = None
+
+    def _wrap_error(self, e):
+        if isinstance(e, pymysql.err.ProgrammingError):
+            return ProgrammingError(origin_error=e)
+        elif isinstance(e.args, tuple) and len(e.args) >= 1:
+            if e.args[0] in self.pe_mysql_error_code_list:
+                return ProgrammingError(origin_error=e)
+            elif e.args[0] in self.of_mysql_error_code_list:
+                return OperationFailure(origin_error=e)
+            else:
+                return UnexpectedError(origin_error=e)
+        else:
+            return UnexpectedError(origin_error=e)
 
-    def _execute(self, query, params, timeout, cursor_func='execute'):
+    def _execute(self, query, params, timeout, cursor_func='execute',
+                 result_format='dicts'):
         if not self.cursor:
             self.connect(self._conf)
 
         self.conn._read_timeout = timeout
         self.conn._write_timeout = timeout
 
+        if result_format == 'dicts':
+            cursor = self.cursor
+        else:
+            # rows as tuples, no dict per row
+            cursor = self.conn.cursor(pymysql.cursors.Cursor)
+            cursor._defer_warnings = True
+
         try:
-            func = getattr(self.cursor, cursor_func)
+            func = getattr(cursor, cursor_func)
             func(query, params)
-        except pymysql.err.ProgrammingError as e:
-            raise ProgrammingError(origin_error=e)
+            if cursor is self.cursor:
+                return list(cursor.fetchall())
+            columns, rows = cursor_columns(cursor), list(cursor.fetchall())
         except Exception as e:
-            if isinstance(e.args, tuple) and len(e.args) >= 1:
-                if e.args[0] in self.pe_mysql_error_code_list:
-                    raise ProgrammingError(origin_error=e)
-                elif e.args[0] in self.of_mysql_error_code_list:
-                    raise OperationFailure(origin_error=e)
-                else:
-                    raise UnexpectedError(origin_error=e)
-            else:
-                raise UnexpectedError(origin_error=e)
-        else:
-            return list(self.cursor.fetchall())
+            raise self._wrap_error(e)
+        finally:
+            if cursor is not self.cursor:
+                cursor.close()
+        return format_result(columns, rows, result_format)
 
-    def execute(self, query, params=None, retry=None, timeout=None, cursor_func='execute'):
+    def _check_pid(self):
         if os.getpid() != self.pid:
             self.close()
             self.pid = os.getpid()
 
-        if retry is None:
-            retry = self.max_op_fail_retry
-
-        if timeout is None:
-            timeout = self.default_timeout
-
-        retry_no = 0
+    def _call_with_retry(self, func, retry, *args):
+        self.retry_policy.request()
+        retry_no, total_delay = 0, 0
         while True:
             try:
-                rows = self._execute(query, params, timeout, cursor_func)
+                return func(*args)
             except OperationFailure as e:
                 self.close()
-                if retry_no < retry:
-                    logger.warning(OP_RETRY_WARNING.format(str(e)))
-                    retry_no += 1
-                else:
+                delay = self.retry_policy.backoff(retry_no, total_delay, retry)
+                if delay is None:
                     raise
+                logger.warning(OP_RETRY_WARNING.format(str(e)))
+                time.sleep(delay)
+                retry_no += 1
+                total_delay += delay
             except ProgrammingError:
                 raise
             except (UnexpectedError, Exception, KeyboardInterrupt):
                 self.close()
                 raise
-            else:
-                return rows
+
+    def execute(self, query, params=None, retry=None, timeout=None, cursor_func='execute',
+                result_format=None):
+        """
+        result_format
+            dicts (default): list of dicts
+            tuples: (columns, list of tuples)
+            columns: {column: values}, values of int or float columns are
+                numpy arrays, or array.array without numpy
+        """
+        self._check_pid()
+        result_format = check_result_format(result_format)
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        return self._call_with_retry(
+            self._execute, retry, query, params, timeout, cursor_func,
+            result_format)
+
+    def _execute_unbuffered(self, query, params, timeout):
+        if not self.cursor:
+            self.connect(self._conf)
+
+        self.conn._read_timeout = timeout
+        self.conn._write_timeout = timeout
+
+        cursor = self.conn.cursor(pymysql.cursors.SSDictCursor)
+        cursor._defer_warnings = True
+        try:
+            cursor.execute(query, params)
+        except Exception as e:
+            raise self._wrap_error(e)
+        return cursor
+
+    def _close_unbuffered(self, cursor, finished):
+        if finished:
+            cursor.close()
+        else:
+            # closing cursor reads all the remaining rows from server,
+            # drop the connection instead, it reconnects lazily
+            self.close()
+
+    def iter_execute(self, query, params=None, retry=None, timeout=None,
+                     chunk_size=None):
+        """
+        stream rows from server without buffering the whole result,
+        yield lists of chunk_size rows if chunk_size is given.
+        only the statement execution is retried, not the fetching.
+        connection is busy until generator is exhausted or closed
+        """
+        self._check_pid()
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        cursor = self._call_with_retry(
+            self._execute_unbuffered, retry, query, params, timeout)
+
+        finished = False
+        try:
+            while True:
+                try:
+                    rows = cursor.fetchmany(chunk_size or DEFAULT_ITER_SIZE)
+                except Exception as e:
+                    raise self._wrap_error(e)
+                if not rows:
+                    break
+                if chunk_size:
+                    yield rows
+                else:
+                    yield from rows
+            finished = True
+        finally:
+            self._close_unbuffered(cursor, finished)
 
     def executemany(self, query, params=None, retry=None, timeout=None, cursor_func='executemany'):
         return self.execute(query, params, retry, timeout, cursor_func=cursor_func)
 
-    def create(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
+    def create(self, collection, data, mode='INSERT', compress_fields=None,
+               update_fields=None, increment_fields=None, **kwargs):
         query, params = query_parameters_from_create(
-            collection, data, mode.upper(), compress_fields
+            collection, data, mode.upper(), compress_fields,
+            update_fields, increment_fields
         )
         try:
             self.execute(query, params, **kwargs)
@@ -176,30 +304,111 @@ class MysqlConnection(BaseConnection):
             else:
                 raise
 
-    def create_many(self, collection, data, mode='INSERT', compress_fields=None, **kwargs):
-        if not isinstance(data, list):
+    def max_packet_size(self, **kwargs):
+        if self._max_packet_size is None:
+            rows = self.execute(
+                'SELECT @@max_allowed_packet AS size', **kwargs)
+            self._max_packet_size = min(
+                int(rows[0]['size']), self.conn.max_allowed_packet)
+        return self._max_packet_size
+
+    def create_many(self, collection, data, mode='INSERT', compress_fields=None,
+                    chunk_size=DEFAULT_CREATE_MANY_CHUNK_SIZE,
+                    raise_on_error=True, columns=None,
+                    update_fields=None, increment_fields=None, **kwargs):
+        """
+        data is a list of dicts, a list of tuples with columns,
+        or a dict of column lists.
+        create with multi-row `VALUES (...), (...)` statements, chunked by
+        chunk_size rows and by estimated size under max_allowed_packet.
+        chunks are sent one after another and each one commits on its own,
+        return status of each chunk,
+            {'rows': 1000, 'affected_rows': 1000, 'error': None}
+        with raise_on_error=False errors are kept in status, not raised.
+        UPSERT mode updates update_fields (default all data fields, keys
+        included) and increments increment_fields of existing rows,
+        as create does
+        """
+        if not isinstance(data, list) and not is_column_data(data):
             data = [data, ]
 
-        query, params = query_parameters_from_create_many(
-            collection, data, mode.upper(), compress_fields
+        max_bytes = int(self.max_packet_size(**kwargs) * PACKET_SIZE_RATIO)
+        chunks = query_parameters_from_create_chunks(
+            collection, data, mode.upper(), compress_fields,
+            chunk_size, max_bytes, columns, update_fields, increment_fields
         )
+
+        return [
+            self._execute_chunk(query, params, row_count, raise_on_error, **kwargs)
+            for query, params, row_count in chunks
+        ]
+
+    def _execute_chunk(self, query, params, row_count, raise_on_error=True, **kwargs):
         try:
-            self.execute(query, params, cursor_func='executemany', **kwargs)
-        except ProgrammingError as e:
-            if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
-                raise DuplicateKeyError(str(e._origin_error))
-            else:
+            try:
+                self.execute(query, params, **kwargs)
+            except ProgrammingError as e:
+                if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
+                    raise DuplicateKeyError(str(e._origin_error))
+                else:
+                    raise
+        except Error as e:
+            if raise_on_error:
                 raise
+            return {'rows': row_count, 'affected_rows': 0, 'error': e}
+        else:
+            return {
+                'rows': row_count,
+                'affected_rows': self.cursor.rowcount,
+                'error': None
+            }
 
     def update(self, collection, data, filters, **kwargs):
         filters = self._check_filters(filters)
         query, params = query_parameters_from_update(collection, filters, data)
         self.execute(query, params, **kwargs)
 
-    def delete(self, collection, filters, **kwargs):
+    def update_many(self, collection, rows, key='id',
+                    chunk_size=DEFAULT_UPDATE_MANY_CHUNK_SIZE,
+                    raise_on_error=True, **kwargs):
+        """
+        rows are dicts with key and the fields to update, like
+            [{'id': 1, 'text': 'a'}, {'id': 2, 'text': 'b'}]
+        rows updating the same fields are sent as chunked
+        `UPDATE ... SET field=CASE key WHEN ... END WHERE key IN (...)`,
+        return status of each chunk as create_many does,
+        affected_rows counts changed rows
+        """
+        if not isinstance(rows, list):
+            rows = [rows, ]
+
+        max_bytes = int(self.max_packet_size(**kwargs) * PACKET_SIZE_RATIO)
+        chunks = query_parameters_from_update_chunks(
+            collection, rows, key, chunk_size, max_bytes)
+        return [
+            self._execute_chunk(query, params, row_count, raise_on_error, **kwargs)
+            for query, params, row_count in chunks
+        ]
+
+    def delete(self, collection, filters, limit=None, **kwargs):
+        """
+        return deleted rows
+        """
         filters = self._check_filters(filters)
-        query, params = query_parameters_from_delete(collection, filters)
+        query, params = query_parameters_from_delete(collection, filters, limit)
         self.execute(query, params, **kwargs)
+        return self.cursor.rowcount
+
+    def delete_many(self, collection, filters=None, key='id',
+                    batch_size=DEFAULT_DELETE_BATCH_SIZE, max_rate=None,
+                    start=None, **kwargs):
+        """
+        bounded deletes for large purges, see chunked_delete
+        """
+        return chunked_delete(
+            self.filter, self.delete, collection, filters, key, batch_size,
+            max_rate, start, **kwargs
+        )
 
     def filter(self, collection, filters=None, fields=None,
                order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
@@ -209,41 +418,461 @@ class MysqlConnection(BaseConnection):
         rows = self.execute(query, params, **kwargs)
         return rows
 
+    def iter_filter(self, collection, filters=None, fields=None,
+                    order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        return self.iter_execute(query, params, **kwargs)
+
     def patch_execute_as_tidb(self):
         self.of_mysql_error_code_list = OF_TIDB_ERROR_CODE_LIST
         self.of_mysql_retry_error_code_list = OF_TIDB_RETRY_ERROR_CODE_LIST
 
 
+# pools re-warmed in child process after fork
+_WARMUP_POOLS = weakref.WeakSet()
+
+
+def _warmup_after_fork():
+    for pool in list(_WARMUP_POOLS):
+        try:
+            pool.warmup()
+        except Exception as e:
+            logger.warning('WARMUP AFTER FORK: {}'.format(str(e)))
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_warmup_after_fork)
+
+
 class MysqlConnectionPool(object):
-    def __init__(self, *args, **kwargs):
-        self.conn_queue = queue.Queue()
-        self._args = args
-        self._kwargs = kwargs
+    """
+    pool options in db conf, all optional
+        min_size: idle connections kept when evicting, default 0
+        max_size: max connections opened by this pool, default unlimited
+        acquire_timeout: seconds to wait for a free connection when
+            max_size is reached, raise PoolTimeout after it, default forever
+        max_idle_time: seconds before an idle connection is closed
+        max_lifetime: seconds before a connection is closed and reopened
+        warmup: connections opened and verified when pool is created,
+            and again in child process after fork, default 0
+        warmup_workers: threads used to open warmup connections, default 1
+
+    connections are reused LIFO, so hot connections stay warm and cold ones
+    sink to the bottom of the stack where they are evicted on acquire and
+    release. eviction has no timer, a pool without requests keeps its idle
+    connections until the next one
+    """
+
+    def __init__(self, conf):
+        self._conf = conf
+
+        self.min_size = conf.get('min_size', 0)
+        self.max_size = conf.get('max_size', None)
+        self.acquire_timeout = conf.get('acquire_timeout', None)
+        self.max_idle_time = conf.get('max_idle_time', None)
+        self.max_lifetime = conf.get('max_lifetime', None)
+        self.warmup_size = conf.get('warmup', 0)
+        self.warmup_workers = conf.get('warmup_workers', 1)
+        self.retry_policy = retry_policy_from_conf(conf)
+
+        self._reset()
 
         for func in CURD_FUNCTIONS:
             setattr(self, func, partial(self._wrap_func, func))
+        for func in ITER_FUNCTIONS:
+            setattr(self, func, partial(self._wrap_iter_func, func))
+
+        if self.warmup_size:
+            _WARMUP_POOLS.add(self)
+            self.warmup()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []  # stack of (connection, released_at)
+        self._size = 0
+
+    def _check_pid(self):
+        if os.getpid() != self.pid:
+            # connections of parent process are not usable in child,
+            # drop them without close, which would quit parent's sessions
+            self._reset()
 
     def get_connection(self):
-        return MysqlConnection(*self._args, **self._kwargs)
+        return MysqlConnection(self._conf, self.retry_policy)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_size(self):
+        return len(self._idle)
+
+    def _is_expired(self, conn, released_at, now):
+        if self.max_idle_time is not None and \
+                now - released_at > self.max_idle_time:
+            return True
+        if self.max_lifetime is not None and conn.connected_at is not None \
+                and now - conn.connected_at > self.max_lifetime:
+            return True
+        return False
+
+    def _evict_idle(self, now):
+        # coldest connections are at the bottom of the stack
+        evicted = []
+        while self._idle and self._size > self.min_size:
+            conn, released_at = self._idle[0]
+            if not self._is_expired(conn, released_at, now):
+                break
+            self._idle.pop(0)
+            self._size -= 1
+            evicted.append(conn)
+        return evicted
 
-    def _wrap_func(self, func, *args, **kwargs):
+    def acquire(self, timeout=None):
+        self._check_pid()
+
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        evicted, conn = [], None
         try:
-            conn = self.conn_queue.get_nowait()
-        except queue.Empty:
-            conn = self.get_connection()
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    # connections idle since a burst are closed here too
+                    evicted.extend(self._evict_idle(now))
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        break
+
+                    if self.max_size is None or self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                origin_error=Exception(
+                                    'no connection available in {}s, '
+                                    'max_size {}'.format(timeout, self.max_size)
+                                )
+                            )
+                        self._cond.wait(remaining)
+        finally:
+            for idle_conn in evicted:
+                idle_conn.close()
+
+        if conn is None:
+            return self.get_connection()
+        if self._is_expired(conn, released_at, now):
+            # keep the slot, connection reconnects lazily on next execute
+            conn.close()
+        return conn
+
+    def release(self, conn):
+        if os.getpid() != self.pid:
+            conn.close()
+            return
+
+        with self._cond:
+            now = time.monotonic()
+            self._idle.append((conn, now))
+            evicted = self._evict_idle(now)
+            self._cond.notify()
+
+        for conn in evicted:
+            conn.close()
 
+    def _open_verified(self):
+        conn = self.get_connection()
         try:
-            return getattr(conn, func)(*args, **kwargs)
-        except:
-            raise
+            conn.ping()
+        except Exception as e:
+            logger.warning('WARMUP: {}'.format(str(e)))
+            conn.close()
+            return None
+        return conn
+
+    def warmup(self, size=None, workers=None):
+        self._check_pid()
+
+        if size is None:
+            size = self.warmup_size
+        if workers is None:
+            workers = self.warmup_workers
+        if self.max_size is not None:
+            size = min(size, self.max_size)
+
+        with self._cond:
+            count = max(size - self._size, 0)
+            self._size += count
+        if not count:
+            return 0
+
+        if workers > 1 and count > 1:
+            with ThreadPoolExecutor(min(workers, count)) as executor:
+                conns = list(executor.map(
+                    lambda _: self._open_verified(), range(count)))
+        else:
+            conns = [self._open_verified() for _ in range(count)]
+        conns = [conn for conn in conns if conn is not None]
+
+        with self._cond:
+            self._size -= count - len(conns)
+            now = time.monotonic()
+            for conn in conns:
+                self._idle.append((conn, now))
+            self._cond.notify_all()
+        return len(conns)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
         finally:
-            self.conn_queue.put_nowait(conn)
+            self.release(conn)
+
+    def _wrap_func(self, func, *args, **kwargs):
+        with self.connection() as conn:
+            return getattr(conn, func)(*args, **kwargs)
+
+    def _wrap_iter_func(self, func, *args, **kwargs):
+        # connection is checked out until generator is exhausted or closed
+        with self.connection() as conn:
+            yield from getattr(conn, func)(*args, **kwargs)
+
+    def update_many(self, collection, rows, key='id',
+                    chunk_size=DEFAULT_UPDATE_MANY_CHUNK_SIZE,
+                    raise_on_error=True, workers=None, **kwargs):
+        """
+        see MysqlConnection.update_many, with workers > 1 chunks are
+        executed in parallel on pool connections, status keeps chunk order
+        """
+        if not workers or workers < 2:
+            return self._wrap_func(
+                'update_many', collection, rows, key, chunk_size,
+                raise_on_error, **kwargs
+            )
+
+        if not isinstance(rows, list):
+            rows = [rows, ]
+
+        with self.connection() as conn:
+            max_packet_size = conn.max_packet_size(**kwargs)
+        chunks = query_parameters_from_update_chunks(
+            collection, rows, key, chunk_size,
+            int(max_packet_size * PACKET_SIZE_RATIO)
+        )
+
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    self._wrap_func, '_execute_chunk',
+                    query, params, row_count, raise_on_error, **kwargs
+                )
+                for query, params, row_count in chunks
+            ]
+        return [future.result() for future in futures]
+
+    def get_many(self, collection, keys, key_field='id', fields=None,
+                 chunk_size=DEFAULT_GET_MANY_CHUNK_SIZE, workers=None, **kwargs):
+        """
+        see chunked_get, with workers > 1 chunks run in parallel
+        on pool connections
+        """
+        if not workers or workers < 2:
+            return chunked_get(
+                self.filter, collection, keys, key_field, fields, chunk_size,
+                **kwargs
+            )
+
+        with ThreadPoolExecutor(workers) as executor:
+            return chunked_get(
+                self.filter, collection, keys, key_field, fields, chunk_size,
+                executor.map, **kwargs
+            )
+
+    def delete_many(self, collection, filters=None, key='id',
+                    batch_size=DEFAULT_DELETE_BATCH_SIZE, max_rate=None,
+                    start=None, **kwargs):
+        # connection is released between chunks
+        return chunked_delete(
+            self.filter, self.delete, collection, filters, key, batch_size,
+            max_rate, start, **kwargs
+        )
+
+    def scan(self, collection, key='id', batch_size=DEFAULT_SCAN_BATCH_SIZE,
+             filters=None, fields=None, start=None, **kwargs):
+        # connection is released between pages
+        return keyset_scan(
+            self.filter, collection, key, batch_size, filters, fields, start,
+            **kwargs
+        )
+
+    def retry_info(self):
+        """
+        operations, retries, operations given up after retries and retries
+        denied by budget, see RetryPolicy
+        """
+        return self.retry_policy.info()
 
     def close(self):
-        while True:
-            try:
-                conn = self.conn_queue.get_nowait()
-            except queue.Empty:
-                break
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _ in idle:
+            conn.close()
+
+
+# conf keys of ReplicatedMysqlConnectionPool, others are shared by all pools
+REPLICATION_CONF_KEYS = ('primary', 'replicas', 'balance', 'read_your_writes')
+BALANCE_MODES = ('round_robin', 'least_in_flight')
+READ_FUNCTIONS = ('filter', 'get', 'exist', 'get_many', 'iter_filter')
+
+
+class ReplicatedMysqlConnectionPool(object):
+    """
+    reads go to replica pools, writes and execute go to primary pool
+    {
+        'primary': {'host': '10.0.0.1'},
+        'replicas': [{'host': '10.0.0.2'}, {'host': '10.0.0.3'}],
+        'balance': 'round_robin',  # or 'least_in_flight'
+        'read_your_writes': 1,
+        'user': 'user',
+        'password': 'password',
+        ...
+    }
+    keys other than primary/replicas/balance/read_your_writes are defaults
+    of primary and replica confs, each of them is a MysqlConnectionPool.
+    reads with `use_primary=True` go to primary, and so do reads of a thread
+    within read_your_writes seconds after its last write
+    """
+
+    def __init__(self, conf):
+        self._conf = conf
+
+        common = dict(
+            (k, v) for k, v in conf.items() if k not in REPLICATION_CONF_KEYS)
+        self.primary = MysqlConnectionPool(dict(common, **conf['primary']))
+        self.replicas = [
+            MysqlConnectionPool(dict(common, **replica))
+            for replica in conf.get('replicas', [])
+        ]
+
+        self.balance = conf.get('balance', 'round_robin')
+        if self.balance not in BALANCE_MODES:
+            raise ProgrammingError(
+                'not supported balance {}'.format(self.balance))
+        self.read_your_writes = conf.get('read_your_writes', 0)
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._in_flight = [0] * len(self.replicas)
+        self._local = threading.local()
+
+        for func in CURD_FUNCTIONS + BULK_FUNCTIONS + ITER_FUNCTIONS:
+            if func == 'iter_filter':
+                setattr(self, func, partial(self._wrap_iter_read, func))
+            elif func in READ_FUNCTIONS:
+                setattr(self, func, partial(self._wrap_read, func))
+            else:
+                setattr(self, func, partial(self._wrap_write, func))
+
+    @property
+    def in_flight(self):
+        return list(self._in_flight)
+
+    def _acquire_replica(self):
+        """
+        index of chosen replica, counted in flight until released
+        """
+        start = next(self._counter)
+        count = len(self.replicas)
+        with self._lock:
+            if self.balance == 'least_in_flight':
+                # ties are rotated, so idle replicas share the load
+                index = min(
+                    [(start + i) % count for i in range(count)],
+                    key=self._in_flight.__getitem__
+                )
             else:
-                conn.close()
+                index = start % count
+            self._in_flight[index] += 1
+        return index
+
+    def _release_replica(self, index):
+        with self._lock:
+            self._in_flight[index] -= 1
+
+    def _read_primary(self, use_primary):
+        if use_primary or not self.replicas:
+            return True
+        written_at = getattr(self._local, 'written_at', None)
+        return bool(
+            self.read_your_writes and written_at is not None and
+            time.monotonic() - written_at < self.read_your_writes
+        )
+
+    def _wrap_read(self, func, *args, use_primary=False, **kwargs):
+        if self._read_primary(use_primary):
+            return getattr(self.primary, func)(*args, **kwargs)
+
+        index = self._acquire_replica()
+        try:
+            return getattr(self.replicas[index], func)(*args, **kwargs)
+        finally:
+            self._release_replica(index)
+
+    def _wrap_iter_read(self, func, *args, use_primary=False, **kwargs):
+        if self._read_primary(use_primary):
+            yield from getattr(self.primary, func)(*args, **kwargs)
+            return
+
+        index = self._acquire_replica()
+        try:
+            yield from getattr(self.replicas[index], func)(*args, **kwargs)
+        finally:
+            self._release_replica(index)
+
+    def _wrap_write(self, func, *args, **kwargs):
+        try:
+            return getattr(self.primary, func)(*args, **kwargs)
+        finally:
+            if self.read_your_writes:
+                self._local.written_at = time.monotonic()
+
+    def scan(self, collection, key='id', batch_size=DEFAULT_SCAN_BATCH_SIZE,
+             filters=None, fields=None, start=None, **kwargs):
+        return keyset_scan(
+            self.filter, collection, key, batch_size, filters, fields, start,
+            **kwargs
+        )
+
+    def retry_info(self):
+        return merge_retry_info(
+            [self.primary.retry_policy] +
+            [replica.retry_policy for replica in self.replicas]
+        )
+
+    def close(self):
+        self.primary.close()
+        for replica in self.replicas:
+            replica.close()
+
+
+def create_mysql_connection_pool(conf):
+    if 'primary' in conf:
+        return ReplicatedMysqlConnectionPool(conf)
+    else:
+        return MysqlConnectionPool(conf)
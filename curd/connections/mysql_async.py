@@ -0,0 +1,349 @@
+import copy
+import time
+import asyncio
+from functools import partial
+
+import aiomysql
+
+from ..errors import (
+    Error, UnexpectedError, OperationFailure, ProgrammingError,
+    ConnectError, PoolTimeout,
+    DuplicateKeyError
+)
+from . import logger
+from .utils.sql import (
+    query_parameters_from_create,
+    query_parameters_from_update,
+    query_parameters_from_delete,
+    query_parameters_from_filter,
+    query_parameters_from_create_chunks,
+    is_column_data)
+from . import (
+    DEFAULT_FILTER_LIMIT, DEFAULT_TIMEOUT, DEFAULT_CREATE_MANY_CHUNK_SIZE,
+    DEFAULT_ASYNC_POOL_SIZE, OP_RETRY_WARNING, CURD_FUNCTIONS, POOL_CONF_KEYS
+)
+from .retry import retry_policy_from_conf
+from .utils.result import check_result_format, cursor_columns, format_result
+from .mysql import (
+    MysqlConnection, MysqlConnectionPool,
+    PE_MYSQL_ERROR_CODE_LIST, PE_DUPLICATE_ENTRY_KEY_ERROR_CODE,
+    OF_MYSQL_ERROR_CODE_LIST, OF_MYSQL_RETRY_ERROR_CODE_LIST,
+    PACKET_SIZE_RATIO
+)
+
+
+class AsyncMysqlConnection(object):
+    """
+    asyncio version of MysqlConnection on aiomysql,
+    errors are classified the same way.
+    aiomysql has no read/write timeout, operations are bounded by
+    asyncio.wait_for instead, and the connection is dropped on timeout
+    """
+
+    pe_mysql_error_code_list = PE_MYSQL_ERROR_CODE_LIST
+    pe_duplicate_entry_key_error_code = PE_DUPLICATE_ENTRY_KEY_ERROR_CODE
+
+    of_mysql_error_code_list = OF_MYSQL_ERROR_CODE_LIST
+    of_mysql_retry_error_code_list = OF_MYSQL_RETRY_ERROR_CODE_LIST
+
+    _wrap_error = MysqlConnection._wrap_error
+    _check_filters = MysqlConnection._check_filters
+    patch_execute_as_tidb = MysqlConnection.patch_execute_as_tidb
+
+    def __init__(self, conf, retry_policy=None):
+        self._conf = conf
+        self.conn, self.cursor = None, None
+        self.connected_at = None
+        self._max_packet_size = None
+
+        self.retry_policy = retry_policy or retry_policy_from_conf(conf)
+        self.max_op_fail_retry = conf.get('max_op_fail_retry', 0)
+        self.default_timeout = conf.get('timeout', DEFAULT_TIMEOUT)
+
+    async def _connect(self, conf):
+        conf = copy.deepcopy(conf)
+
+        self.max_op_fail_retry = conf.pop('max_op_fail_retry', 0)
+        self.default_timeout = conf.pop('timeout', DEFAULT_TIMEOUT)
+        for key in POOL_CONF_KEYS:
+            conf.pop(key, None)
+
+        if 'database' in conf:
+            conf['db'] = conf.pop('database')
+
+        conf['use_unicode'] = True
+        conf['charset'] = 'utf8mb4'
+        conf['autocommit'] = True
+
+        if conf.pop('tidb_patch', False):
+            self.patch_execute_as_tidb()
+
+        conn = await aiomysql.connect(**conf)
+        cursor = await conn.cursor(aiomysql.DictCursor)
+        return conn, cursor
+
+    async def connect(self, conf):
+        try:
+            self.conn, self.cursor = await self._connect(conf)
+        except Exception as e:
+            raise ConnectError(origin_error=e)
+        self.connected_at = time.monotonic()
+
+    def close(self):
+        if self.conn:
+            try:
+                self.conn.close()
+            except Exception as e:
+                logger.warning(str(e))
+
+        self.conn, self.cursor = None, None
+        self.connected_at = None
+        self._max_packet_size = None
+
+    async def _execute(self, query, params, timeout, result_format='dicts'):
+        if not self.cursor:
+            await self.connect(self._conf)
+
+        if result_format == 'dicts':
+            cursor = self.cursor
+        else:
+            # rows as tuples, no dict per row
+            cursor = await self.conn.cursor(aiomysql.Cursor)
+
+        try:
+            await asyncio.wait_for(cursor.execute(query, params), timeout)
+            if cursor is self.cursor:
+                return list(await cursor.fetchall())
+            columns, rows = cursor_columns(cursor), list(await cursor.fetchall())
+        except asyncio.TimeoutError as e:
+            raise OperationFailure(origin_error=e)
+        except Exception as e:
+            raise self._wrap_error(e)
+        finally:
+            if cursor is not self.cursor:
+                await cursor.close()
+        return format_result(columns, rows, result_format)
+
+    async def execute(self, query, params=None, retry=None, timeout=None,
+                      result_format=None):
+        """
+        result_format, see MysqlConnection.execute
+        """
+        result_format = check_result_format(result_format)
+
+        if retry is None:
+            retry = self.max_op_fail_retry
+
+        if timeout is None:
+            timeout = self.default_timeout
+
+        self.retry_policy.request()
+        retry_no, total_delay = 0, 0
+        while True:
+            try:
+                return await self._execute(
+                    query, params, timeout, result_format)
+            except OperationFailure as e:
+                self.close()
+                delay = self.retry_policy.backoff(retry_no, total_delay, retry)
+                if delay is None:
+                    raise
+                logger.warning(OP_RETRY_WARNING.format(str(e)))
+                await asyncio.sleep(delay)
+                retry_no += 1
+                total_delay += delay
+            except ProgrammingError:
+                raise
+            except (UnexpectedError, Exception, KeyboardInterrupt,
+                    asyncio.CancelledError):
+                self.close()
+                raise
+
+    async def create(self, collection, data, mode='INSERT', compress_fields=None,
+                     update_fields=None, increment_fields=None, **kwargs):
+        query, params = query_parameters_from_create(
+            collection, data, mode.upper(), compress_fields,
+            update_fields, increment_fields
+        )
+        try:
+            await self.execute(query, params, **kwargs)
+        except ProgrammingError as e:
+            if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
+                raise DuplicateKeyError(str(e._origin_error))
+            else:
+                raise
+
+    async def max_packet_size(self, **kwargs):
+        if self._max_packet_size is None:
+            rows = await self.execute(
+                'SELECT @@max_allowed_packet AS size', **kwargs)
+            self._max_packet_size = int(rows[0]['size'])
+        return self._max_packet_size
+
+    async def create_many(self, collection, data, mode='INSERT', compress_fields=None,
+                          chunk_size=DEFAULT_CREATE_MANY_CHUNK_SIZE,
+                          raise_on_error=True, columns=None,
+                          update_fields=None, increment_fields=None, **kwargs):
+        if not isinstance(data, list) and not is_column_data(data):
+            data = [data, ]
+
+        max_packet_size = await self.max_packet_size(**kwargs)
+        chunks = query_parameters_from_create_chunks(
+            collection, data, mode.upper(), compress_fields,
+            chunk_size, int(max_packet_size * PACKET_SIZE_RATIO), columns,
+            update_fields, increment_fields
+        )
+
+        status = []
+        for query, params, row_count in chunks:
+            try:
+                try:
+                    await self.execute(query, params, **kwargs)
+                except ProgrammingError as e:
+                    if e._origin_error.args[0] == self.pe_duplicate_entry_key_error_code:
+                        raise DuplicateKeyError(str(e._origin_error))
+                    else:
+                        raise
+            except Error as e:
+                if raise_on_error:
+                    raise
+                status.append(
+                    {'rows': row_count, 'affected_rows': 0, 'error': e})
+            else:
+                status.append({
+                    'rows': row_count,
+                    'affected_rows': self.cursor.rowcount,
+                    'error': None
+                })
+        return status
+
+    async def update(self, collection, data, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_update(collection, filters, data)
+        await self.execute(query, params, **kwargs)
+
+    async def delete(self, collection, filters, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_delete(collection, filters)
+        await self.execute(query, params, **kwargs)
+
+    async def filter(self, collection, filters=None, fields=None,
+                     order_by=None, limit=DEFAULT_FILTER_LIMIT, **kwargs):
+        filters = self._check_filters(filters)
+        query, params = query_parameters_from_filter(
+            collection, filters, fields, order_by, limit)
+        rows = await self.execute(query, params, **kwargs)
+        return rows
+
+    async def get(self, collection, filters=None, fields=None, **kwargs):
+        rows = await self.filter(collection, filters, fields, limit=1, **kwargs)
+        if rows:
+            return rows[0]
+        else:
+            return None
+
+    async def exist(self, collection, filters, **kwargs):
+        if filters:
+            fields = [filters[0][1]]
+            data = await self.get(collection, filters, fields=fields, **kwargs)
+            if data:
+                return True
+            else:
+                return False
+        else:
+            raise ProgrammingError('exist without filter is not supported')
+
+
+class AsyncMysqlConnectionPool(object):
+    """
+    asyncio pool of AsyncMysqlConnection, same options as MysqlConnectionPool
+    except warmup. max_size defaults to DEFAULT_ASYNC_POOL_SIZE, callers wait
+    for a free connection, which is the backpressure
+    """
+
+    _is_expired = MysqlConnectionPool._is_expired
+    _evict_idle = MysqlConnectionPool._evict_idle
+
+    def __init__(self, conf):
+        self._conf = conf
+
+        self.min_size = conf.get('min_size', 0)
+        self.max_size = conf.get('max_size', None) or DEFAULT_ASYNC_POOL_SIZE
+        self.acquire_timeout = conf.get('acquire_timeout', None)
+        self.max_idle_time = conf.get('max_idle_time', None)
+        self.max_lifetime = conf.get('max_lifetime', None)
+        self.retry_policy = retry_policy_from_conf(conf)
+
+        self._idle = []  # stack of (connection, released_at)
+        self._size = 0
+        # created in running loop
+        self._semaphore = None
+
+        for func in CURD_FUNCTIONS:
+            setattr(self, func, partial(self._wrap_func, func))
+
+    def get_connection(self):
+        return AsyncMysqlConnection(self._conf, self.retry_policy)
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_size(self):
+        return len(self._idle)
+
+    async def acquire(self, timeout=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_size)
+
+        if timeout is None:
+            timeout = self.acquire_timeout
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                origin_error=Exception(
+                    'no connection available in {}s, '
+                    'max_size {}'.format(timeout, self.max_size)
+                )
+            )
+
+        now = time.monotonic()
+        # connections idle since a burst are closed here too
+        for idle_conn in self._evict_idle(now):
+            idle_conn.close()
+        if self._idle:
+            conn, released_at = self._idle.pop()
+            if self._is_expired(conn, released_at, now):
+                # keep the slot, connection reconnects lazily on next execute
+                conn.close()
+            return conn
+
+        self._size += 1
+        return self.get_connection()
+
+    def release(self, conn):
+        now = time.monotonic()
+        self._idle.append((conn, now))
+        for idle_conn in self._evict_idle(now):
+            idle_conn.close()
+
+        self._semaphore.release()
+
+    async def _wrap_func(self, func, *args, **kwargs):
+        conn = await self.acquire()
+        try:
+            return await getattr(conn, func)(*args, **kwargs)
+        finally:
+            self.release(conn)
+
+    def retry_info(self):
+        return self.retry_policy.info()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        self._size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
@@ -0,0 +1,175 @@
+import time
+import random
+import threading
+
+
+DEFAULT_RETRY_BASE_DELAY = 0.1
+DEFAULT_RETRY_MAX_DELAY = 5
+DEFAULT_RETRY_BUDGET_RATIO = 0.1
+DEFAULT_RETRY_BUDGET_MIN_RATE = 1
+DEFAULT_RETRY_BUDGET_CAPACITY = 10
+
+
+class RetryBudget(object):
+    """
+    token bucket capping retries at a fraction of requests,
+    every request adds ratio tokens, every retry takes one token,
+    min_rate tokens per second are added so that rare requests can retry,
+    at most capacity tokens are kept
+    """
+
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET_RATIO,
+                 min_rate=DEFAULT_RETRY_BUDGET_MIN_RATE,
+                 capacity=DEFAULT_RETRY_BUDGET_CAPACITY):
+        self.ratio = ratio
+        self.min_rate = min_rate
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self, tokens=0):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated_at) * self.min_rate + tokens)
+        self._updated_at = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """
+        take a token for a retry, False if budget is exhausted
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RetryPolicy(object):
+    """
+    delay before retrying an OperationFailure, exponential backoff with
+    full jitter: random between 0 and min(max_delay, base_delay * 2 ** n)
+    before the nth retry (from 0). retries stop after max_op_fail_retry
+    (or retry of the call), max_total_delay seconds waited, or when budget
+    has no token.
+    one policy is shared by connections of a pool, subclass and pass it
+    as `retry` in db conf to change the policy
+    """
+
+    def __init__(self, base_delay=DEFAULT_RETRY_BASE_DELAY,
+                 max_delay=DEFAULT_RETRY_MAX_DELAY, max_total_delay=None,
+                 budget=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_delay = max_total_delay
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.budget_exhausted = 0
+
+    def __deepcopy__(self, memo):
+        # connections deep copy their conf, policy stays shared
+        return self
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def request(self):
+        """
+        called once per operation, before its first attempt
+        """
+        self._count('requests')
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def delay(self, retry_no):
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** retry_no))
+
+    def backoff(self, retry_no, total_delay, max_retries):
+        """
+        seconds to wait before retry retry_no, None to give up.
+        total_delay is waited seconds of this operation
+        """
+        if retry_no >= max_retries:
+            if max_retries:
+                self._count('gave_up')
+            return None
+
+        delay = self.delay(retry_no)
+        if self.max_total_delay is not None:
+            if total_delay >= self.max_total_delay:
+                self._count('gave_up')
+                return None
+            delay = min(delay, self.max_total_delay - total_delay)
+
+        if self.budget is not None and not self.budget.withdraw():
+            self._count('budget_exhausted')
+            return None
+
+        self._count('retries')
+        return delay
+
+    def info(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'gave_up': self.gave_up,
+                'budget_exhausted': self.budget_exhausted
+            }
+
+
+def retry_policy_from_conf(conf):
+    """
+    `retry` of db conf is a RetryPolicy, or its options
+        base_delay: seconds, default DEFAULT_RETRY_BASE_DELAY
+        max_delay: max seconds before a retry, default DEFAULT_RETRY_MAX_DELAY
+        max_total_delay: max seconds waited by an operation, default no limit
+        budget: RetryBudget options (ratio, min_rate, capacity), default no budget
+    """
+    retry = conf.get('retry', None) or {}
+    if isinstance(retry, RetryPolicy):
+        return retry
+
+    budget = retry.get('budget', None)
+    if budget is not None:
+        budget = RetryBudget(
+            budget.get('ratio', DEFAULT_RETRY_BUDGET_RATIO),
+            budget.get('min_rate', DEFAULT_RETRY_BUDGET_MIN_RATE),
+            budget.get('capacity', DEFAULT_RETRY_BUDGET_CAPACITY)
+        )
+    return RetryPolicy(
+        retry.get('base_delay', DEFAULT_RETRY_BASE_DELAY),
+        retry.get('max_delay', DEFAULT_RETRY_MAX_DELAY),
+        retry.get('max_total_delay', None),
+        budget
+    )
+
+
+def merge_retry_info(policies):
+    """
+    sum of counters of policies, a policy shared by pools is counted once
+    """
+    info = {'requests': 0, 'retries': 0, 'gave_up': 0, 'budget_exhausted': 0}
+    for policy in dict((id(p), p) for p in policies).values():
+        for k, v in policy.info().items():
+            info[k] += v
+    return info
@@ -7,6 +7,14 @@ from cassandra.cqlengine.statements import (
     six
 )
 from cassandra.cqlengine.operators import BaseWhereOperator
+import re
+from functools import lru_cache
+
+
+# prepared queries kept per statement shape
+STATEMENT_CACHE_SIZE = 1024
+
+PLACEHOLDER_RE = re.compile(r'%\((\d+)\)s')
 
 
 class SelectStatement(_SelectStatement):
@@ -59,16 +67,50 @@ def where_clauses_from_filters(filters):
     return where_clauses
 
 
-def assignment_clauses_from_data(data):
-    assignment_clauses = []
-    for k, v in data.items():
-        assignment_clauses.append(AssignmentClause(k, v))
-    return assignment_clauses
+class Slot(object):
+    """
+    stands for the value at index while compiling a statement shape
+    """
 
+    def __init__(self, index):
+        self.index = index
 
-def query_parameters_from_create(collection, data, mode='INSERT'):
-    assignment_clauses = assignment_clauses_from_data(data)
-    if mode == 'REPLACE':
+
+def compile_statement(statement):
+    """
+    query with `?` markers to prepare, and index of value bound to each marker
+    """
+    context = statement.get_context()
+    order = []
+
+    def marker(match):
+        value = context[match.group(1)]
+        # IN values are wrapped by quoter
+        order.append(getattr(value, 'value', value).index)
+        return '?'
+
+    query = PLACEHOLDER_RE.sub(marker, str(statement))
+    return query, tuple(order)
+
+
+def where_shape_from_filters(filters):
+    return tuple((op.upper(), k) for op, k, _ in filters)
+
+
+def slot_filters_from_shape(where_shape):
+    return [(op, k, Slot(i)) for i, (op, k) in enumerate(where_shape)]
+
+
+def params_from_order(order, values):
+    return [values[i] for i in order]
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_create(collection, fields, mode):
+    assignment_clauses = [
+        AssignmentClause(f, Slot(i)) for i, f in enumerate(fields)]
+    # cassandra INSERT overwrites, UPSERT is the same as REPLACE
+    if mode in ('REPLACE', 'UPSERT'):
         statement = InsertStatement(
             table=collection, assignments=assignment_clauses,
         )
@@ -77,34 +119,91 @@ def query_parameters_from_create(collection, data, mode='INSERT'):
             table=collection, assignments=assignment_clauses,
             if_not_exists=True
         )
-    return str(statement), statement.get_context()
+    return compile_statement(statement)
 
 
-def query_parameters_from_update(collection, filters, data):
-    where_clauses = where_clauses_from_filters(filters)
-    assignment_clauses = assignment_clauses_from_data(data)
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_update(collection, where_shape, fields):
+    where_clauses = where_clauses_from_filters(
+        slot_filters_from_shape(where_shape))
+    assignment_clauses = [
+        AssignmentClause(f, Slot(len(where_shape) + i))
+        for i, f in enumerate(fields)
+    ]
     statement = UpdateStatement(
         table=collection, assignments=assignment_clauses,
         where=where_clauses, if_exists=True
     )
-    return str(statement), statement.get_context()
+    return compile_statement(statement)
 
 
-def query_parameters_from_delete(collection, filters):
-    where_clauses = where_clauses_from_filters(filters)
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_delete(collection, where_shape):
+    where_clauses = where_clauses_from_filters(
+        slot_filters_from_shape(where_shape))
     statement = DeleteStatement(
         table=collection, where=where_clauses
     )
-    return str(statement), statement.get_context()
+    return compile_statement(statement)
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_select(collection, where_shape, fields, order_by, limit):
+    where_clauses = where_clauses_from_filters(
+        slot_filters_from_shape(where_shape))
+    statement = SelectStatement(
+        table=collection, fields=list(fields) if fields else None,
+        where=where_clauses, allow_filtering=True,
+        order_by=list(order_by) if order_by else None, limit=limit
+    )
+    return compile_statement(statement)
+
+
+STATEMENT_COMPILERS = (
+    compile_create, compile_update, compile_delete, compile_select
+)
+
+
+def statement_cache_info():
+    hits, misses, size = 0, 0, 0
+    for compiler in STATEMENT_COMPILERS:
+        info = compiler.cache_info()
+        hits += info.hits
+        misses += info.misses
+        size += info.currsize
+    return {'hits': hits, 'misses': misses, 'size': size}
+
+
+def clear_statement_cache():
+    for compiler in STATEMENT_COMPILERS:
+        compiler.cache_clear()
+
+
+def query_parameters_from_create(collection, data, mode='INSERT'):
+    query, order = compile_create(collection, tuple(data.keys()), mode)
+    return query, params_from_order(order, list(data.values()))
+
+
+def query_parameters_from_update(collection, filters, data):
+    query, order = compile_update(
+        collection, where_shape_from_filters(filters), tuple(data.keys()))
+    values = [v for _, _, v in filters] + list(data.values())
+    return query, params_from_order(order, values)
+
+
+def query_parameters_from_delete(collection, filters):
+    query, order = compile_delete(
+        collection, where_shape_from_filters(filters))
+    return query, params_from_order(order, [v for _, _, v in filters])
 
 
 def query_parameters_from_filter(
     collection, filters, fields=None, order_by=None, limit=None
 ):
-    where_clauses = where_clauses_from_filters(filters)
-    statement = SelectStatement(
-        table=collection, fields=fields,
-        where=where_clauses, allow_filtering=True,
-        order_by=order_by, limit=limit
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    query, order = compile_select(
+        collection, where_shape_from_filters(filters),
+        tuple(fields or ()), tuple(order_by or ()), limit
     )
-    return str(statement), statement.get_context()
+    return query, params_from_order(order, [v for _, _, v in filters])
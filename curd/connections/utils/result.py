@@ -0,0 +1,68 @@
+import array
+from collections import OrderedDict
+
+from ...errors import ProgrammingError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# dicts: list of dicts, tuples: (columns, list of tuples),
+# columns: {column: list of values}, numeric columns as arrays
+RESULT_FORMATS = ('dicts', 'tuples', 'columns')
+
+
+def check_result_format(result_format):
+    if result_format is None:
+        return 'dicts'
+    if result_format not in RESULT_FORMATS:
+        raise ProgrammingError(
+            'result_format {} is not supported, use one of {}'.format(
+                result_format, RESULT_FORMATS))
+    return result_format
+
+
+def cursor_columns(cursor):
+    # dbapi description, name is the first item
+    return [d[0] for d in cursor.description or ()]
+
+
+def numeric_column(values):
+    """
+    numpy array, or array.array without numpy, of an int or float column,
+    None if column has other values (None, bool, Decimal, ...) or overflows
+    """
+    kinds = set(map(type, values))
+    if not kinds:
+        return None
+    elif kinds == {int}:
+        typecode, dtype = 'q', 'int64'
+    elif kinds <= {int, float}:
+        typecode, dtype = 'd', 'float64'
+    else:
+        return None
+
+    try:
+        if numpy is not None:
+            return numpy.array(values, dtype=dtype)
+        return array.array(typecode, values)
+    except OverflowError:
+        return None
+
+
+def format_result(columns, rows, result_format):
+    """
+    rows are tuples (or lists) of values in column order
+    """
+    if result_format == 'tuples':
+        return list(columns), [
+            row if isinstance(row, tuple) else tuple(row) for row in rows]
+
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    result = OrderedDict()
+    for column, column_values in zip(columns, values):
+        numeric = numeric_column(column_values)
+        result[column] = list(column_values) if numeric is None else numeric
+    return result
@@ -1,6 +1,63 @@
 from datetime import datetime, timezone
-
-from curd import UnexpectedError
+from functools import lru_cache
+from operator import itemgetter
+from collections import OrderedDict
+
+from curd import UnexpectedError, ProgrammingError
+
+
+# compiled query templates kept per statement shape
+STATEMENT_CACHE_SIZE = 1024
+
+# values which normalize_value may change
+NORMALIZED_TYPES = (datetime, list, tuple)
+
+
+def normalize_value(value):
+    if isinstance(value, datetime) and value.tzinfo:
+        return value.astimezone(tz=timezone.utc).replace(tzinfo=None)
+    elif isinstance(value, list) or isinstance(value, tuple):
+        new_value = []
+        for v in value:
+            if isinstance(value, datetime) and value.tzinfo:
+                new_value.append(
+                    v.astimezone(tz=timezone.utc).replace(tzinfo=None)
+                )
+            else:
+                new_value.append(v)
+        return new_value
+    else:
+        return value
+
+
+class Dialect(object):
+    """
+    identifier quote, placeholder and create statement of a sql dialect
+    """
+
+    def __init__(self, name, quote, placeholder, create_modes, on_duplicate):
+        self.name = name
+        self.quote = quote
+        self.placeholder = placeholder
+        self.create_modes = create_modes
+        # mode: ON DUPLICATE KEY clause, UPDATE is generated from fields
+        self.on_duplicate = on_duplicate
+
+
+MYSQL_DIALECT = Dialect(
+    'mysql', '`', '%s',
+    {'INSERT': 'INSERT', 'IGNORE': 'INSERT IGNORE', 'REPLACE': 'REPLACE',
+     'UPSERT': 'INSERT'},
+    {'UPSERT': 'UPDATE'}
+)
+# phoenix has no INSERT, UPSERT overwrites given fields
+PHOENIX_DIALECT = Dialect(
+    'phoenix', '"', '?',
+    {'INSERT': 'UPSERT', 'IGNORE': 'UPSERT', 'REPLACE': 'UPSERT',
+     'UPSERT': 'UPSERT'},
+    {'IGNORE': 'IGNORE'}
+)
+DIALECTS = dict((d.name, d) for d in [MYSQL_DIALECT, PHOENIX_DIALECT])
 
 
 class BaseClause(object):
@@ -8,27 +65,19 @@ class BaseClause(object):
         self._field = field
         self._value = value
 
+    def quoted(self, quote='`'):
+        return '.'.join([
+            '{0}{1}{0}'.format(quote, i)
+            for i in self._field.replace('`', '').replace('"', '').split('.')
+        ])
+
     @property
     def field(self):
-        return '.'.join(
-            ['`{}`'.format(i) for i in self._field.replace('`', '').split('.')])
+        return self.quoted()
 
     @property
     def value(self):
-        if isinstance(self._value, datetime) and self._value.tzinfo:
-            return self._value.astimezone(tz=timezone.utc).replace(tzinfo=None)
-        elif isinstance(self._value, list) or isinstance(self._value, tuple):
-            value = []
-            for v in self._value:
-                if isinstance(self._value, datetime) and self._value.tzinfo:
-                    value.append(
-                        v.astimezone(tz=timezone.utc).replace(tzinfo=None)
-                    )
-                else:
-                    value.append(v)
-            return value
-        else:
-            return self._value
+        return normalize_value(self._value)
 
 
 class WhereClause(BaseClause):
@@ -56,12 +105,16 @@ class AssignmentClause(BaseClause):
 
 
 class BaseSQLStatement(object):
-    def __init__(self):
+    def __init__(self, dialect=None):
         self.query = None
         self.params = []
+        self.dialect = dialect or MYSQL_DIALECT
+
+    def quote(self, clause):
+        return clause.quoted(self.dialect.quote)
 
     def generate_query_field(self, table):
-        return table.field
+        return self.quote(table)
 
     def generate_query_where(self, where):
         query = ''
@@ -74,9 +127,10 @@ class BaseSQLStatement(object):
                     value_count = len(where_clause.value)
                     segs.append(
                         '{} {} {}'.format(
-                            where_clause.field,
+                            self.quote(where_clause),
                             where_clause.operator,
-                            '({})'.format(', '.join(['%s'] * value_count))
+                            '({})'.format(', '.join(
+                                [self.dialect.placeholder] * value_count))
                         )
                     )
 
@@ -85,7 +139,8 @@ class BaseSQLStatement(object):
                 else:
                     segs.append(
                         '{} {} {}'.format(
-                            where_clause.field, where_clause.operator, '%s'
+                            self.quote(where_clause), where_clause.operator,
+                            self.dialect.placeholder
                         )
                     )
                     self.params.append(where_clause.value)
@@ -94,7 +149,7 @@ class BaseSQLStatement(object):
 
     def generate_query_fields(self, fields):
         if fields:
-            return ', '.join([field_clause.field for field_clause in fields])
+            return ', '.join([self.quote(field_clause) for field_clause in fields])
         else:
             return '*'
 
@@ -112,9 +167,9 @@ class BaseSQLStatement(object):
             for field_clause in order_by:
                 if field_clause._field.startswith('-'):
                     field_clause._field = field_clause._field[1:]
-                    seg = field_clause.field + ' DESC'
+                    seg = self.quote(field_clause) + ' DESC'
                 else:
-                    seg = field_clause.field
+                    seg = self.quote(field_clause)
                 segs.append(seg)
             query += ', '.join(segs)
         return query
@@ -123,8 +178,9 @@ class BaseSQLStatement(object):
 class SelectStatement(BaseSQLStatement):
     BASE_QUERY = 'SELECT {} FROM {} {}'
 
-    def __init__(self, table, fields=None, where=None, order_by=None, limit=None):
-        super().__init__()
+    def __init__(self, table, fields=None, where=None, order_by=None, limit=None,
+                 dialect=None):
+        super().__init__(dialect)
 
         self.table = table
         self.fields = fields
@@ -153,15 +209,17 @@ class SelectStatement(BaseSQLStatement):
 class DeleteStatement(BaseSQLStatement):
     BASE_QUERY = 'DELETE FROM {} {}'
 
-    def __init__(self, table, where=None):
-        super().__init__()
+    def __init__(self, table, where=None, limit=None, dialect=None):
+        super().__init__(dialect)
         self.table = table
         self.where = where
+        self.limit = limit
 
     def as_sql(self):
         query_table = self.generate_query_field(self.table)
         query_where = self.generate_query_where(self.where)
-        extra_query = query_where
+        query_limit = self.generate_query_limit(self.limit)
+        extra_query = ' '.join([i for i in [query_where, query_limit] if i])
 
         self.query = self.BASE_QUERY.format(
             query_table, extra_query
@@ -171,36 +229,69 @@ class DeleteStatement(BaseSQLStatement):
 
 class CreateStatement(BaseSQLStatement):
     BASE_QUERY = '{} INTO {} ({}) VALUES ({})'
+    HEAD_QUERY = '{} INTO {} ({}) VALUES'
+    ROW_QUERY = '({})'
+    ON_DUPLICATE_QUERY = 'ON DUPLICATE KEY {}'
 
-    def __init__(self, table, assignments, mode, compress_fields):
-        super().__init__()
+    def __init__(self, table, assignments, mode, compress_fields,
+                 update_fields=None, increment_fields=None, dialect=None):
+        super().__init__(dialect)
         self.table = table
         self.assignments = assignments
         self.mode = mode
         self.compress_fields = compress_fields
+        self.update_fields = update_fields
+        self.increment_fields = increment_fields
 
     def generate_query_mode(self, mode):
-        if mode == 'INSERT':
-            return 'INSERT'
-        elif mode == 'IGNORE':
-            return 'INSERT IGNORE'
-        elif mode == 'REPLACE':
-            return 'REPLACE'
+        return self.dialect.create_modes.get(mode, None)
 
     def generate_query_fields_values(self, assignments, compress_fields):
-        fields = [a.field for a in assignments]
-        query_values = ['%s'] * len(assignments)
+        fields = [self.quote(a) for a in assignments]
+        placeholder = self.dialect.placeholder
+        query_values = [placeholder] * len(assignments)
         if type(compress_fields) == list:
             for index, field in enumerate(fields):
                 for cf in compress_fields:
-                    if '`' + cf + '`' == field:  # field should be like '`id`'
-                        query_values[index] = 'COMPRESS(%s)'
+                    if self.quote(FieldClause(cf)) == field:  # field should be like '`id`'
+                        query_values[index] = 'COMPRESS({})'.format(placeholder)
         query_fields = ', '.join(fields)
         query_values = ', '.join(query_values)
         for a in assignments:
             self.params.append(a.value)
         return query_fields, query_values
 
+    def generate_query_on_duplicate(self, mode, assignments,
+                                    update_fields, increment_fields):
+        """
+        mysql UPSERT updates update_fields (all created fields by default)
+        with the new values, and adds the new values to increment_fields.
+        primary key is unknown here, so the default list has key columns
+        too, `id`=VALUES(`id`) is a no-op, callers pass update_fields to
+        keep statements short
+        phoenix IGNORE keeps existing rows
+        """
+        on_duplicate = self.dialect.on_duplicate.get(mode, None)
+        if on_duplicate != 'UPDATE':
+            return self.ON_DUPLICATE_QUERY.format(on_duplicate) if on_duplicate else ''
+
+        increment_fields = [
+            self.quote(FieldClause(f)) for f in increment_fields or []]
+        if update_fields is None:
+            update_fields = [
+                self.quote(a) for a in assignments
+                if self.quote(a) not in increment_fields
+            ]
+        else:
+            update_fields = [self.quote(FieldClause(f)) for f in update_fields]
+
+        segs = ['{0}=VALUES({0})'.format(f) for f in update_fields]
+        segs.extend(['{0}={0}+VALUES({0})'.format(f) for f in increment_fields])
+        if not segs:
+            # keep existing row, unlike IGNORE other errors are still raised
+            segs = ['{0}={0}'.format(self.quote(assignments[0]))]
+        return self.ON_DUPLICATE_QUERY.format('UPDATE ' + ', '.join(segs))
+
     def as_sql(self):
 
         query_mode = self.generate_query_mode(self.mode)
@@ -211,24 +302,51 @@ class CreateStatement(BaseSQLStatement):
             self.assignments, self.compress_fields
         )
 
+        query_on_duplicate = self.generate_query_on_duplicate(
+            self.mode, self.assignments,
+            self.update_fields, self.increment_fields
+        )
+
         self.query = self.BASE_QUERY.format(
             query_mode, query_table, query_fields, query_values
         )
+        if query_on_duplicate:
+            self.query += ' ' + query_on_duplicate
         return self.query, self.params
 
+    def as_sql_template(self):
+        """
+        head, row and tail of multi-row create, `head row, row, ... tail`
+        """
+        query_mode = self.generate_query_mode(self.mode)
+
+        query_table = self.generate_query_field(self.table)
+
+        query_fields, query_values = self.generate_query_fields_values(
+            self.assignments, self.compress_fields
+        )
+
+        head = self.HEAD_QUERY.format(query_mode, query_table, query_fields)
+        row = self.ROW_QUERY.format(query_values)
+        tail = self.generate_query_on_duplicate(
+            self.mode, self.assignments,
+            self.update_fields, self.increment_fields
+        )
+        return head, row, tail
+
 
 class UpdateStatement(BaseSQLStatement):
     BASE_QUERY = 'UPDATE {} SET {} {}'
 
-    def __init__(self, table, assignments, where=None):
-        super().__init__()
+    def __init__(self, table, assignments, where=None, dialect=None):
+        super().__init__(dialect)
         self.table = table
         self.assignments = assignments
         self.where = where
 
     def generate_query_fields_values(self, assignments):
         query = ', '.join(
-            [a.field + '=%s' for a in assignments]
+            [self.quote(a) + '=' + self.dialect.placeholder for a in assignments]
         )
         for a in assignments:
             self.params.append(a.value)
@@ -248,6 +366,39 @@ class UpdateStatement(BaseSQLStatement):
         return self.query, self.params
 
 
+class UpdateManyStatement(BaseSQLStatement):
+    BASE_QUERY = 'UPDATE {} SET {} WHERE {} IN ({})'
+    CASE_QUERY = '{0}=CASE {1} {2} ELSE {0} END'
+
+    def __init__(self, table, key, fields, row_count, dialect=None):
+        super().__init__(dialect)
+        self.table = table
+        self.key = key
+        self.fields = fields
+        self.row_count = row_count
+
+    def as_sql(self):
+        """
+        params are key and value of each row for each field, then keys
+        """
+        query_table = self.generate_query_field(self.table)
+        query_key = self.quote(self.key)
+        placeholder = self.dialect.placeholder
+
+        query_whens = ' '.join(
+            ['WHEN {0} THEN {0}'.format(placeholder)] * self.row_count)
+        query_cases = ', '.join([
+            self.CASE_QUERY.format(self.quote(f), query_key, query_whens)
+            for f in self.fields
+        ])
+        query_keys = ', '.join([placeholder] * self.row_count)
+
+        self.query = self.BASE_QUERY.format(
+            query_table, query_cases, query_key, query_keys
+        )
+        return self.query, self.params
+
+
 def where_clauses_from_filters(filters):
     where_clauses = []
     for op, k, v in filters:
@@ -264,72 +415,366 @@ def assignment_clauses_clauses_from_filters(data):
     return assignment_clauses
 
 
-def query_parameters_from_create(collection, data, mode='INSERT', compress_fields=None):
-    table = FieldClause(collection)
-    assignments = assignment_clauses_clauses_from_filters(data)
-    query, params = CreateStatement(table, assignments, mode, compress_fields).as_sql()
-    return query, params
+def where_shape_from_filters(filters):
+    """
+    hashable shape of filters: operator, field and IN-list arity,
+    or whether value is None for operators which become IS / IS NOT
+    """
+    shape = []
+    for op, k, v in filters:
+        if op == 'IN':
+            shape.append((op, k, len(v)))
+        else:
+            shape.append((op, k, v is None))
+    return tuple(shape)
 
 
-def query_parameters_from_create_many(collection, data, mode='INSERT', compress_fields=None):
-    table = FieldClause(collection)
-    assignments = [assignment_clauses_clauses_from_filters(each) for each in data]
-    query = None
-    params = []
-    _item_length = None
-    for index, assignment in enumerate(assignments):
-        _query, _params = CreateStatement(table, assignment, mode, compress_fields).as_sql()
+def where_filters_from_shape(where_shape):
+    filters = []
+    for op, k, arity in where_shape:
+        if op == 'IN':
+            filters.append((op, k, [None] * arity))
+        else:
+            filters.append((op, k, None if arity else 0))
+    return filters
 
-        # check each item length
-        if _item_length is None:
-            _item_length = len(_params)
+
+def where_params_from_filters(filters):
+    params = []
+    for op, k, v in filters:
+        if op == 'IN':
+            params.extend(normalize_value(v))
         else:
-            if len(_params) != _item_length:
-                raise UnexpectedError(
-                    'Received data varies in length, expecting all equal %s, but got %s(%s)' % (
-                        _item_length, len(_params), data[index]))
+            params.append(normalize_value(v))
+    return params
 
-        if query is None:
-            query = _query
-        params.append(_params)
-    return query, params
+
+def order_by_shape(order_by):
+    if order_by is None:
+        return ()
+    elif isinstance(order_by, str):
+        return (order_by, )
+    else:
+        return tuple(order_by)
 
 
-def query_parameters_from_update(collection, filters, data):
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_create(collection, fields, mode, compress_fields,
+                   update_fields=None, increment_fields=None, dialect='mysql'):
     table = FieldClause(collection)
-    assignments = assignment_clauses_clauses_from_filters(data)
-    where = where_clauses_from_filters(filters)
-    query, params = UpdateStatement(table, assignments, where).as_sql()
-    return query, params
+    assignments = [AssignmentClause(f, None) for f in fields]
+    query, _ = CreateStatement(
+        table, assignments, mode,
+        list(compress_fields) if compress_fields is not None else None,
+        update_fields, increment_fields, DIALECTS[dialect]
+    ).as_sql()
+    return query
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_create_rows(collection, fields, mode, compress_fields,
+                        update_fields=None, increment_fields=None,
+                        dialect='mysql'):
+    table = FieldClause(collection)
+    assignments = [AssignmentClause(f, None) for f in fields]
+    return CreateStatement(
+        table, assignments, mode,
+        list(compress_fields) if compress_fields is not None else None,
+        update_fields, increment_fields, DIALECTS[dialect]
+    ).as_sql_template()
 
 
-def query_parameters_from_get(collection, filters, fields=None):
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_update(collection, fields, where_shape, dialect='mysql'):
     table = FieldClause(collection)
-    where = where_clauses_from_filters(filters)
-    fields = [FieldClause(f) for f in (fields or [])]
-    query, params = SelectStatement(table, fields, where, limit=1).as_sql()
-    return query, params
+    assignments = [AssignmentClause(f, None) for f in fields]
+    where = where_clauses_from_filters(where_filters_from_shape(where_shape))
+    query, _ = UpdateStatement(
+        table, assignments, where, DIALECTS[dialect]).as_sql()
+    return query
 
 
-def query_parameters_from_delete(collection, filters):
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_update_rows(collection, key, fields, row_count, dialect='mysql'):
     table = FieldClause(collection)
-    where = where_clauses_from_filters(filters)
-    query, params = DeleteStatement(table, where).as_sql()
-    return query, params
+    fields = [FieldClause(f) for f in fields]
+    query, _ = UpdateManyStatement(
+        table, FieldClause(key), fields, row_count, DIALECTS[dialect]).as_sql()
+    return query
 
 
-def query_parameters_from_filter(
-        collection, filters, fields=None, order_by=None, limit=None):
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_delete(collection, where_shape, limit=None, dialect='mysql'):
     table = FieldClause(collection)
-    where = where_clauses_from_filters(filters)
-    fields = [FieldClause(f) for f in (fields or [])]
+    where = where_clauses_from_filters(where_filters_from_shape(where_shape))
+    query, _ = DeleteStatement(table, where, limit, DIALECTS[dialect]).as_sql()
+    return query
 
-    if order_by is None:
-        order_by = []
-    elif isinstance(order_by, str):
-        order_by = [order_by]
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def compile_select(collection, where_shape, fields, order_by, limit,
+                   dialect='mysql'):
+    table = FieldClause(collection)
+    where = where_clauses_from_filters(where_filters_from_shape(where_shape))
+    fields = [FieldClause(f) for f in fields]
     order_by = [FieldClause(f) for f in order_by]
+    query, _ = SelectStatement(
+        table, fields, where, order_by, limit, DIALECTS[dialect]).as_sql()
+    return query
+
+
+STATEMENT_COMPILERS = (
+    compile_create, compile_create_rows, compile_update, compile_update_rows,
+    compile_delete, compile_select
+)
+
+
+def statement_cache_info():
+    hits, misses, size = 0, 0, 0
+    for compiler in STATEMENT_COMPILERS:
+        info = compiler.cache_info()
+        hits += info.hits
+        misses += info.misses
+        size += info.currsize
+    return {'hits': hits, 'misses': misses, 'size': size}
+
+
+def clear_statement_cache():
+    for compiler in STATEMENT_COMPILERS:
+        compiler.cache_clear()
+
 
-    query, params = SelectStatement(
-        table, fields, where, order_by, limit).as_sql()
+def compress_fields_shape(compress_fields):
+    # only list enables compress, as CreateStatement checks
+    if type(compress_fields) == list:
+        return tuple(compress_fields)
+    else:
+        return None
+
+
+def fields_shape(fields):
+    if fields is None:
+        return None
+    else:
+        return tuple(fields)
+
+
+def query_parameters_from_create(collection, data, mode='INSERT', compress_fields=None,
+                                 update_fields=None, increment_fields=None,
+                                 dialect='mysql'):
+    query = compile_create(
+        collection, tuple(data.keys()), mode,
+        compress_fields_shape(compress_fields),
+        fields_shape(update_fields), fields_shape(increment_fields), dialect
+    )
+    params = [normalize_value(v) for v in data.values()]
+    return query, params
+
+
+def is_column_data(data):
+    """
+    dict of column lists, a single row can't have only list values,
+    which are not valid sql values
+    """
+    return isinstance(data, dict) and bool(data) and all(
+        isinstance(v, (list, tuple)) for v in data.values())
+
+
+def columns_rows_from_create_many(data, columns=None):
+    """
+    column order and row values of create_many data, data is one of
+        list of dicts with the same keys
+        list of tuples, with columns
+        dict of column lists, like {'id': [1, 2], 'text': ['a', 'b']}
+    column order is resolved once, from columns or the first row
+    """
+    if isinstance(data, dict):
+        columns = tuple(data.keys())
+        if not columns:
+            raise ProgrammingError('create_many of rows without columns')
+        lengths = set(len(v) for v in data.values())
+        if len(lengths) > 1:
+            raise UnexpectedError(
+                'Received columns vary in length, got %s' % (
+                    dict((k, len(v)) for k, v in data.items())))
+        rows = zip(*data.values())
+    elif not data:
+        return tuple(columns or ()), []
+    elif isinstance(data[0], dict):
+        if columns is None:
+            columns = tuple(data[0].keys())
+        else:
+            columns = tuple(columns)
+        if not columns:
+            raise ProgrammingError('create_many of rows without columns')
+        keys = set(columns)
+        getter = itemgetter(*columns)
+        for index, row in enumerate(data):
+            if row.keys() != keys:
+                raise UnexpectedError(
+                    'Received data varies in keys, expecting %s, but got %s(%s)' % (
+                        sorted(keys), sorted(row.keys()), data[index]))
+        if len(columns) == 1:
+            rows = ((getter(row), ) for row in data)
+        else:
+            rows = map(getter, data)
+    else:
+        if columns is None:
+            raise UnexpectedError('Received rows without columns')
+        columns = tuple(columns)
+        for index, row in enumerate(data):
+            if len(row) != len(columns):
+                raise UnexpectedError(
+                    'Received data varies in length, expecting all equal %s, but got %s(%s)' % (
+                        len(columns), len(row), data[index]))
+        rows = data
+
+    params = [
+        [normalize_value(v) if isinstance(v, NORMALIZED_TYPES) else v
+         for v in row]
+        for row in rows
+    ]
+    return columns, params
+
+
+def query_parameters_from_create_many(collection, data, mode='INSERT',
+                                      compress_fields=None, columns=None,
+                                      update_fields=None, increment_fields=None,
+                                      dialect='mysql'):
+    columns, params = columns_rows_from_create_many(data, columns)
+    if not columns:
+        return None, params
+    query = compile_create(
+        collection, columns, mode, compress_fields_shape(compress_fields),
+        fields_shape(update_fields), fields_shape(increment_fields), dialect)
+    return query, params
+
+
+def estimate_param_size(value):
+    if value is None:
+        return 4
+    elif isinstance(value, str):
+        return len(value.encode('utf-8')) + 2
+    elif isinstance(value, (bytes, bytearray)):
+        return len(value) + 10
+    else:
+        return len(str(value)) + 2
+
+
+def query_parameters_from_create_chunks(
+        collection, data, mode='INSERT', compress_fields=None,
+        chunk_size=None, max_bytes=None, columns=None,
+        update_fields=None, increment_fields=None):
+    """
+    split rows into multi-row `VALUES (...), (...)` statements with at most
+    chunk_size rows and about max_bytes estimated size each,
+    yield (query, params, row_count)
+    """
+    columns, rows_params = columns_rows_from_create_many(data, columns)
+    if not rows_params:
+        return
+
+    head, row, tail = compile_create_rows(
+        collection, columns, mode, compress_fields_shape(compress_fields),
+        fields_shape(update_fields), fields_shape(increment_fields))
+    row_size = len(row) + 2
+    if tail:
+        tail = ' ' + tail
+
+    def chunk_query_params(chunk):
+        query = head + ' ' + ', '.join([row] * len(chunk)) + tail
+        params = [v for row_params in chunk for v in row_params]
+        return query, params, len(chunk)
+
+    chunk, chunk_bytes = [], len(head) + len(tail)
+    for row_params in rows_params:
+        row_bytes = row_size + sum(map(estimate_param_size, row_params))
+        if chunk and (
+                (chunk_size and len(chunk) >= chunk_size) or
+                (max_bytes and chunk_bytes + row_bytes > max_bytes)):
+            yield chunk_query_params(chunk)
+            chunk, chunk_bytes = [], len(head) + len(tail)
+        chunk.append(row_params)
+        chunk_bytes += row_bytes
+    if chunk:
+        yield chunk_query_params(chunk)
+
+
+def query_parameters_from_update(collection, filters, data, dialect='mysql'):
+    query = compile_update(
+        collection, tuple(data.keys()), where_shape_from_filters(filters),
+        dialect)
+    params = [normalize_value(v) for v in data.values()]
+    params.extend(where_params_from_filters(filters))
+    return query, params
+
+
+def query_parameters_from_update_chunks(
+        collection, rows, key='id', chunk_size=None, max_bytes=None):
+    """
+    rows are dicts with key and the fields to update, rows updating the same
+    fields are packed into `UPDATE ... SET field=CASE key WHEN ... END
+    WHERE key IN (...)` statements with at most chunk_size rows and about
+    max_bytes estimated size each, yield (query, params, row_count)
+    """
+    groups = OrderedDict()
+    for index, row in enumerate(rows):
+        if key not in row:
+            raise UnexpectedError(
+                'Received row without key %s(%s)' % (key, rows[index]))
+        fields = tuple(k for k in row.keys() if k != key)
+        if not fields:
+            continue
+        groups.setdefault(fields, []).append(row)
+
+    def chunk_query_params(fields, chunk):
+        query = compile_update_rows(collection, key, fields, len(chunk))
+        params = []
+        for field in fields:
+            for row in chunk:
+                params.append(normalize_value(row[key]))
+                params.append(normalize_value(row[field]))
+        params.extend([normalize_value(row[key]) for row in chunk])
+        return query, params, len(chunk)
+
+    for fields, group in groups.items():
+        # per row: WHEN %s THEN %s of each field, and %s of IN
+        row_size = 18 * len(fields) + 4
+        chunk, chunk_bytes = [], 0
+        for row in group:
+            key_bytes = estimate_param_size(row[key])
+            row_bytes = row_size + key_bytes * (len(fields) + 1) + sum(
+                estimate_param_size(row[field]) for field in fields)
+            if chunk and (
+                    (chunk_size and len(chunk) >= chunk_size) or
+                    (max_bytes and chunk_bytes + row_bytes > max_bytes)):
+                yield chunk_query_params(fields, chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(row)
+            chunk_bytes += row_bytes
+        if chunk:
+            yield chunk_query_params(fields, chunk)
+
+
+def query_parameters_from_get(collection, filters, fields=None, dialect='mysql'):
+    return query_parameters_from_filter(
+        collection, filters, fields, limit=1, dialect=dialect)
+
+
+def query_parameters_from_delete(collection, filters, limit=None,
+                                 dialect='mysql'):
+    query = compile_delete(
+        collection, where_shape_from_filters(filters), limit, dialect)
+    params = where_params_from_filters(filters)
+    return query, params
+
+
+def query_parameters_from_filter(
+        collection, filters, fields=None, order_by=None, limit=None,
+        dialect='mysql'):
+    query = compile_select(
+        collection, where_shape_from_filters(filters),
+        tuple(fields or ()), order_by_shape(order_by), limit, dialect
+    )
+    params = where_params_from_filters(filters)
     return query, params
@@ -22,6 +22,22 @@ class ConnectError(WrappedError):
     BASE_MESSAGE = 'ConnectError'
 
 
+class PoolTimeout(ConnectError):
+    '''
+    no connection available in pool before acquire timeout
+    '''
+
+    BASE_MESSAGE = 'PoolTimeout'
+
+
+class CircuitOpenError(ConnectError):
+    '''
+    circuit breaker of database is open, request is not sent
+    '''
+
+    BASE_MESSAGE = 'CircuitOpenError'
+
+
 class UnexpectedError(WrappedError):
     '''
     uncategorized errors
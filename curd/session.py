@@ -1,34 +1,61 @@
+import os
 import json
+import asyncio
+import threading
 from functools import partial
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from .connections import CURD_FUNCTIONS
+from .connections import (
+    CURD_FUNCTIONS, SESSION_FUNCTIONS, ASYNC_FUNCTIONS, DEFAULT_GATHER_WORKERS
+)
 
 from .errors import ProgrammingError
+from .cache import CachedConnectionPool
+from .breaker import CircuitBreakerConnectionPool
 
 
 DB_CONNECTION_POOL = {}
+ASYNC_DB_CONNECTION_POOL = {}
 
 try:
-    from .connections.mysql import MysqlConnectionPool
+    from .connections.mysql import create_mysql_connection_pool
 except Exception:
     pass
 else:
-    DB_CONNECTION_POOL['mysql'] = MysqlConnectionPool
+    DB_CONNECTION_POOL['mysql'] = create_mysql_connection_pool
 
 try:
-    from .connections.cassandra import CassandraConnectionPool
+    from .connections.mysql_async import AsyncMysqlConnectionPool
+except Exception:
+    pass
+else:
+    ASYNC_DB_CONNECTION_POOL['mysql'] = AsyncMysqlConnectionPool
+
+try:
+    from .connections.cassandra import (
+        CassandraConnectionPool, AsyncCassandraConnectionPool
+    )
 except Exception:
     pass
 else:
     DB_CONNECTION_POOL['cassandra'] = CassandraConnectionPool
+    ASYNC_DB_CONNECTION_POOL['cassandra'] = AsyncCassandraConnectionPool
 
 try:
-    from .connections.hbase import HbaseConnectionPool
+    from .connections.hbase import (
+        HbaseConnectionPool, AsyncHbaseConnectionPool
+    )
 except Exception:
     pass
 else:
     DB_CONNECTION_POOL['hbase'] = HbaseConnectionPool
+    ASYNC_DB_CONNECTION_POOL['hbase'] = AsyncHbaseConnectionPool
+
+
+def conf_key(db):
+    # objects in conf, like a RetryPolicy, are keyed by identity
+    return json.dumps(db, default=repr)
 
 
 class Session(object):
@@ -42,7 +69,31 @@ class Session(object):
             'user': 'user',
             'password': 'password',
             'max_op_fail_retry': 3,
-            'timeout': 60
+            'retry': {
+                'base_delay': 0.1,
+                'max_delay': 5,
+                'max_total_delay': 30,
+                'budget': {'ratio': 0.1, 'min_rate': 1, 'capacity': 10}
+            },
+            'timeout': 60,
+            'max_size': 20,
+            'acquire_timeout': 10,
+            'max_idle_time': 300,
+            'warmup': 5,
+            'warmup_workers': 5
+        }
+    }
+    mysql with read replicas, see ReplicatedMysqlConnectionPool
+    {
+        'type': 'mysql',
+        'conf': {
+            'primary': {'host': '10.0.0.1'},
+            'replicas': [{'host': '10.0.0.2'}, {'host': '10.0.0.3'}],
+            'balance': 'least_in_flight',
+            'read_your_writes': 1,
+            'port': 3306,
+            'user': 'user',
+            'password': 'password'
         }
     }
     tidb conf
@@ -66,7 +117,9 @@ class Session(object):
             'username': 'username',
             'password': 'password',
             'max_op_fail_retry': 3,
-            'timeout': 60
+            'timeout': 60,
+            'prepared_cache_size': 1024,
+            'concurrency': 100
         }
     }
     hbase db conf
@@ -78,20 +131,65 @@ class Session(object):
             'password': '',
         }
     }
+    read-through cache and coalesced reads of any db, see CachedConnectionPool
+    {
+        'type': 'mysql',
+        'conf': {...},
+        'cache': {
+            'size': 10000,
+            'ttl': 60,
+            'collections': {'db.config': 600}
+        },
+        'single_flight': True
+    }
+    circuit breaker of any db, see CircuitBreakerConnectionPool
+    {
+        'type': 'mysql',
+        'conf': {...},
+        'circuit_breaker': {
+            'failure_threshold': 5,
+            'reset_timeout': 30,
+            'on_state_change': alert
+        }
+    }
     """
+
+    db_connection_pool = DB_CONNECTION_POOL
+    cached_connection_pool = CachedConnectionPool
+    circuit_breaker_connection_pool = CircuitBreakerConnectionPool
+    functions = SESSION_FUNCTIONS
     
     def __init__(self, dbs=None):
         self._connection_cache = OrderedDict()
         self._default_connection = None
+        self._reset_executors()
         
         if dbs:
             for db in dbs:
                 self._get_connection(db)
         
     def _create_connection(self, db):
-        class_conn_pool = DB_CONNECTION_POOL.get(db['type'], None)
+        class_conn_pool = self.db_connection_pool.get(db['type'], None)
         if class_conn_pool:
-            return class_conn_pool(db['conf'])
+            cache_conf = db.get('cache', None)
+            single_flight = db.get('single_flight', False)
+            breaker_conf = db.get('circuit_breaker', None)
+            if (cache_conf is not None or single_flight) and \
+                    not self.cached_connection_pool:
+                raise ProgrammingError('cache and single_flight are not supported')
+            if breaker_conf is not None and \
+                    not self.circuit_breaker_connection_pool:
+                raise ProgrammingError('circuit_breaker is not supported')
+
+            pool = class_conn_pool(db['conf'])
+            if breaker_conf is not None:
+                pool = self.circuit_breaker_connection_pool(
+                    pool, breaker_conf, db['type'])
+            if cache_conf is not None or single_flight:
+                # cached results are served while circuit is open
+                pool = self.cached_connection_pool(
+                    pool, cache_conf, single_flight)
+            return pool
         else:
             if db['type'] in ['mysql', 'cassandra', 'hbase']:
                 raise ProgrammingError('no database driver')
@@ -99,7 +197,7 @@ class Session(object):
                 raise ProgrammingError('not supported database')
         
     def set_default_connection(self, db):
-        key = json.dumps(db)
+        key = conf_key(db)
         conn = self._connection_cache.get(key, None)
         if not conn:
             conn = self._create_connection(db)
@@ -107,7 +205,7 @@ class Session(object):
         self._default_connection = conn
         
     def _get_connection(self, db):
-        key = json.dumps(db)
+        key = conf_key(db)
         conn = self._connection_cache.get(key, None)
         if conn:
             return conn
@@ -127,7 +225,7 @@ class Session(object):
             return self._default_connection
         
     def __getattr__(self, item):
-        if item in CURD_FUNCTIONS:
+        if item in self.functions or item in ASYNC_FUNCTIONS:
             if self._default_connection:
                 return getattr(self._default_connection, item)
             else:
@@ -135,12 +233,149 @@ class Session(object):
         else:
             raise AttributeError
             
+    def cache_info(self):
+        """
+        hits, misses, evictions and size of all db caches,
+        and reads coalesced by single-flight
+        """
+        info = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'coalesced': 0}
+        for conn in self._connection_cache.values():
+            if isinstance(conn, CachedConnectionPool):
+                for k, v in conn.cache_info().items():
+                    info[k] += v
+        return info
+
+    def retry_info(self):
+        """
+        operations, retries, operations given up after retries and retries
+        denied by budget of all dbs, see RetryPolicy
+        """
+        info = {'requests': 0, 'retries': 0, 'gave_up': 0, 'budget_exhausted': 0}
+        for conn in self._connection_cache.values():
+            if hasattr(conn, 'retry_info'):
+                for k, v in conn.retry_info().items():
+                    info[k] += v
+        return info
+
+    def _resolve_op(self, op):
+        if callable(op):
+            return op
+        elif op in self.functions:
+            return getattr(self, op)
+        else:
+            raise ProgrammingError('not supported operation {}'.format(op))
+
+    def _op_calls(self, ops):
+        calls = []
+        for spec in ops:
+            op, args, kwargs = (tuple(spec) + ({}, ))[:3]
+            calls.append((self._resolve_op(op), args, kwargs))
+        return calls
+
+    def _default_workers(self):
+        pool = self._default_connection
+        size = getattr(pool, 'max_size', None) or getattr(pool, 'concurrency', None)
+        return size or DEFAULT_GATHER_WORKERS
+
+    def _reset_executors(self):
+        self._pid = os.getpid()
+        self._executors_lock = threading.Lock()
+        self._executors = {}
+
+    def _get_executor(self, max_workers=None):
+        if os.getpid() != self._pid:
+            # threads and lock of parent process are not inherited
+            self._reset_executors()
+
+        if max_workers is None:
+            max_workers = self._default_workers()
+
+        with self._executors_lock:
+            executor = self._executors.get(max_workers, None)
+            if not executor:
+                executor = ThreadPoolExecutor(max_workers)
+                self._executors[max_workers] = executor
+        return executor
+
+    def gather(self, ops, max_workers=None, raise_on_error=False):
+        """
+        run independent operations concurrently, results in input order.
+        op spec: (op, args) or (op, args, kwargs), op is an operation name
+        or a callable, e.g. `session.using(db).get` for another db.
+        failed operations return their error in place,
+        the first error in input order is raised with `raise_on_error`
+        """
+        calls = self._op_calls(ops)
+        executor = self._get_executor(max_workers)
+        futures = [
+            executor.submit(func, *args, **kwargs)
+            for func, args, kwargs in calls
+        ]
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+    def map(self, op, arg_iter, max_workers=None, raise_on_error=False, **kwargs):
+        """
+        `op(*args, **kwargs)` for each args in arg_iter, see gather
+        """
+        return self.gather(
+            [(op, args, kwargs) for args in arg_iter],
+            max_workers, raise_on_error
+        )
+
     def close(self):
         for k, v in self._connection_cache.items():
             v.close()
         self._connection_cache = OrderedDict()
         self._default_connection = None
 
+        with self._executors_lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+
+
+class AsyncSession(Session):
+    """
+    asyncio Session, same db conf and interface as Session,
+    operations are awaitable, `await session.close()`.
+    mysql needs aiomysql, requests wait for a free connection
+    when `max_size` connections of the pool are in use
+    """
+
+    db_connection_pool = ASYNC_DB_CONNECTION_POOL
+    cached_connection_pool = None
+    circuit_breaker_connection_pool = None
+    functions = CURD_FUNCTIONS
+
+    async def gather(self, ops, raise_on_error=False):
+        """
+        concurrency is bounded by the pools, see Session.gather
+        """
+        calls = self._op_calls(ops)
+        return await asyncio.gather(
+            *[func(*args, **kwargs) for func, args, kwargs in calls],
+            return_exceptions=not raise_on_error
+        )
+
+    async def map(self, op, arg_iter, raise_on_error=False, **kwargs):
+        return await self.gather(
+            [(op, args, kwargs) for args in arg_iter], raise_on_error)
+
+    async def close(self):
+        for k, v in self._connection_cache.items():
+            await v.close()
+        self._connection_cache = OrderedDict()
+        self._default_connection = None
+
 
 class F(object):
     def __init__(self, value):
@@ -175,7 +410,7 @@ class SimpleCollection(object):
         self.timeout = timeout
         self.retry = retry
         
-        for func in CURD_FUNCTIONS:
+        for func in self.s.functions:
             setattr(
                 self,
                 func,
@@ -13,6 +13,7 @@ setup(
     extras_require={
         'cassandra': ['cassandra-driver==3.11.0'],
         'hbase': ['phoenixdb==0.7'],
-        'mysql': ['PyMySQL==0.7.11']
+        'mysql': ['PyMySQL==0.7.11'],
+        'aiomysql': ['PyMySQL==0.7.11', 'aiomysql==0.0.15']
     }
 )
@@ -1,11 +1,15 @@
 import pytest
 
 import time
+import asyncio
 
 from multiprocessing.pool import ThreadPool
 from threading import current_thread
 
-from curd import DuplicateKeyError, OperationFailure, UnexpectedError
+from curd import (
+    DuplicateKeyError, OperationFailure, UnexpectedError, PoolTimeout,
+    ProgrammingError
+)
 
 
 def create(session, create_test_table):
@@ -49,6 +53,43 @@ def create_many(session, create_test_table):
         session.create_many(collection, data3, mode='ignore')
 
 
+def upsert(session, create_test_table, size=100):
+    collection = create_test_table(session)
+
+    session.create(collection, {'id': 1, 'text': 'test'}, mode='upsert')
+    session.create(collection, {'id': 1, 'text': 'upserted'}, mode='upsert')
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'upserted'
+
+    session.create(
+        collection, {'id': 1, 'text': 'kept'}, mode='upsert', update_fields=[])
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'upserted'
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    session.create_many(collection, data, mode='upsert', chunk_size=10)
+    items = session.filter(collection, limit=None)
+    assert items == data
+
+    data = [{'id': i, 'text': 'upserted'} for i in range(1, size * 2 + 1)]
+    session.create_many(collection, data, mode='upsert', update_fields=['text'])
+    items = session.filter(collection, limit=None)
+    assert items == data
+
+
+def upsert_fields_not_supported(session, create_test_table):
+    collection = create_test_table(session)
+    data = {'id': 1, 'text': 'test'}
+
+    with pytest.raises(ProgrammingError):
+        session.create(collection, data, mode='upsert', update_fields=['text'])
+    with pytest.raises(ProgrammingError):
+        session.create_many(
+            collection, [data], mode='upsert', update_fields=['text'])
+    with pytest.raises(ProgrammingError):
+        session.create_many(
+            collection, [data], mode='upsert', increment_fields=['id'])
+    assert session.filter(collection, limit=None) == []
+
+
 def update(session, create_test_table):
     collection = create_test_table(session)
     data = {'id': 100, 'text': 'test'}
@@ -58,6 +99,24 @@ def update(session, create_test_table):
     assert d['text'] == 't2'
 
 
+def update_many(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    session.create_many(collection, data)
+
+    rows = [{'id': i, 'text': 'updated{}'.format(i)} for i in range(1, size + 1)]
+    status = session.update_many(collection, rows, chunk_size=100)
+    assert len(status) == size // 100
+    assert sum(s['affected_rows'] for s in status) == size
+    assert session.filter(collection, limit=None) == rows
+
+    rows = [{'id': i, 'text': 'parallel{}'.format(i)} for i in range(1, size + 1)]
+    status = session.update_many(collection, rows, chunk_size=100, workers=4)
+    assert [s['rows'] for s in status] == [100] * (size // 100)
+    assert session.filter(collection, limit=None) == rows
+
+
 def delete(session, create_test_table):
     collection = create_test_table(session)
     data = {'id': 100, 'text': 'test'}
@@ -68,6 +127,38 @@ def delete(session, create_test_table):
     assert d is None
 
 
+def delete_many(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    session.create_many(collection, data)
+
+    filters = [('>', 'id', size // 2)]
+    assert session.delete_many(collection, filters, batch_size=100) == size // 2
+    assert len(session.filter(collection, limit=None)) == size // 2
+    assert session.delete_many(collection, filters, batch_size=100) == 0
+
+    begin = time.time()
+    assert session.delete_many(
+        collection, key=None, batch_size=100, max_rate=1000) == size // 2
+    assert time.time() - begin >= 0.4
+    assert session.filter(collection, limit=None) == []
+
+
+def get_many(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    session.create_many(collection, data)
+
+    keys = list(range(1, size + 1)) + list(range(1, 11)) + [size + 1]
+    items = session.get_many(collection, keys, chunk_size=100)
+    assert items == dict((item['id'], item) for item in data)
+
+    items = session.get_many(collection, keys, fields=['text'], chunk_size=100, workers=4)
+    assert items == dict((item['id'], item) for item in data)
+
+
 def normal_filter(session, create_test_table, size=1000):
     collection = create_test_table(session)
     for i in range(1, 2 * size):
@@ -96,6 +187,27 @@ def filter_with_order_by(session, create_test_table, size=1000):
     assert [item['id'] for item in items] == [32, 16, 1]
 
 
+def result_format(session, create_test_table, size=100):
+    collection = create_test_table(session)
+    for i in range(1, size + 1):
+        session.create(collection, {'id': i, 'text': 'test'})
+
+    columns, rows = session.filter(
+        collection, fields=['id', 'text'], limit=None, result_format='tuples')
+    assert columns == ['id', 'text']
+    assert sorted(rows) == [(i, 'test') for i in range(1, size + 1)]
+
+    items = session.filter(
+        collection, fields=['id', 'text'], limit=None, result_format='columns')
+    assert sorted(items['id']) == list(range(1, size + 1))
+    assert items['text'] == ['test'] * size
+
+    items = session.filter(
+        collection, [('>', 'id', size)], fields=['id'], result_format='columns')
+    assert list(items['id']) == []
+    assert session.filter(collection, [('=', 'id', 1)]) == [{'id': 1, 'text': 'test'}]
+
+
 def timeout(session, create_test_table):
     collection = create_test_table(session)
     for i in range(1, 2000):
@@ -108,6 +220,17 @@ def timeout(session, create_test_table):
         print(items)
 
 
+def retry_policy(session, create_test_table):
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+
+    info = session.retry_info()
+    with pytest.raises(OperationFailure):
+        session.filter(collection, timeout=0.000001, retry=2)
+    assert session.retry_info()['retries'] == info['retries'] + 2
+    assert session.retry_info()['gave_up'] == info['gave_up'] + 1
+
+
 def thread_pool(session, create_test_table, size=10000):
     collection = create_test_table(session)
 
@@ -128,3 +251,243 @@ def thread_pool(session, create_test_table, size=10000):
     for item in items:
         t_names.add(item['text'])
     assert len(t_names) == pool_size
+
+
+def bounded_pool(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+    pool = session.using()
+
+    def create(i):
+        session.create(collection, {'id': i, 'text': 'test'})
+
+    thread_pool = ThreadPool(pool.max_size * 4)
+    thread_pool.map(create, range(1, size))
+    thread_pool.terminate()
+
+    assert pool.size <= pool.max_size
+    assert len(session.filter(collection, limit=None)) == size - 1
+
+    conns = [pool.acquire() for _ in range(pool.max_size)]
+    with pytest.raises(PoolTimeout):
+        pool.acquire(timeout=0.1)
+    for conn in conns:
+        pool.release(conn)
+
+
+def warmup_pool(session, create_test_table):
+    pool = session.using()
+    assert pool.idle_size == pool.warmup_size
+
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+    assert pool.size == pool.warmup_size
+
+
+def iter_filter(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+    for i in range(1, size + 1):
+        session.create(collection, {'id': i, 'text': 'test'})
+
+    ids = [item['id'] for item in session.iter_filter(
+        collection, [('>=', 'id', 1)], fields=['id'], order_by='id')]
+    assert ids == list(range(1, size + 1))
+
+    chunks = list(session.iter_filter(
+        collection, [('>=', 'id', 1)], order_by='id', chunk_size=300))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+
+    rows = session.iter_filter(collection, [('>=', 'id', 1)])
+    next(rows)
+    rows.close()
+    assert session.get(collection, [('=', 'id', 1)])['id'] == 1
+
+
+def scan(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+    for i in range(1, size + 1):
+        session.create(collection, {'id': i, 'text': str(i % 2)})
+
+    ids = [item['id'] for item in session.scan(collection, batch_size=300)]
+    assert ids == list(range(1, size + 1))
+
+    items = list(session.scan(
+        collection, batch_size=300, filters=[('=', 'text', '0')],
+        fields=['text'], start=size // 2))
+    assert [item['id'] for item in items] == list(range(size // 2 + 2, size + 1, 2))
+
+
+def create_many_chunks(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    status = session.create_many(collection, data, chunk_size=300)
+    assert [s['rows'] for s in status] == [300, 300, 300, 100]
+    assert sum(s['affected_rows'] for s in status) == size
+
+    data = [{'id': i, 'text': 'test'} for i in range(size - 10, size + 11)]
+    status = session.create_many(
+        collection, data, chunk_size=10, raise_on_error=False)
+    assert isinstance(status[0]['error'], DuplicateKeyError)
+    assert status[-1]['error'] is None
+    assert len(session.filter(collection, limit=None)) == size + 10
+
+
+def create_many_columns(session, create_test_table):
+    collection = create_test_table(session)
+
+    session.create_many(
+        collection, [(1, 'a'), (2, 'b')], columns=['id', 'text'])
+    session.create_many(collection, {'id': [3, 4], 'text': ['c', 'd']})
+    items = session.filter(collection, order_by='id')
+    assert [(item['id'], item['text']) for item in items] == [
+        (1, 'a'), (2, 'b'), (3, 'c'), (4, 'd')]
+
+    with pytest.raises(UnexpectedError):
+        session.create_many(
+            collection, [{'id': 5, 'text': 'e'}, {'id': 6, 'other': 'f'}])
+    with pytest.raises(ProgrammingError):
+        session.create_many(collection, [{}])
+
+
+def create_many_concurrent(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    assert session.create_many(collection, data, concurrency=50) == []
+    assert len(session.filter(collection, limit=None)) == size
+
+    failures = session.create_many(collection, data[:10] + [{'id': 0}])
+    assert [index for index, _ in failures] == list(range(10))
+    assert all(isinstance(e, DuplicateKeyError) for _, e in failures)
+
+    data = [{'id': i, 'text': 'replaced'} for i in range(1, size + 1)]
+    assert session.create_many(collection, data, mode='replace') == []
+    items = session.filter(collection, limit=None)
+    assert set(item['text'] for item in items) == {'replaced', None}
+
+
+def async_operations(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    futures = [
+        session.create_async(collection, {'id': i, 'text': 'test'})
+        for i in range(1, size + 1)
+    ]
+    for future in futures:
+        future.result()
+
+    with pytest.raises(DuplicateKeyError):
+        session.create_async(collection, {'id': 1, 'text': 'test'}).result()
+
+    futures = [
+        session.get_async(collection, [('=', 'id', i)])
+        for i in range(1, size + 1)
+    ]
+    assert [future.result()['id'] for future in futures] == list(range(1, size + 1))
+    assert len(session.filter_async(collection, limit=None).result()) == size
+
+
+def async_session(session, async_session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    async def run():
+        await asyncio.gather(*[
+            async_session.create(collection, {'id': i, 'text': 'test'})
+            for i in range(1, size + 1)
+        ])
+
+        with pytest.raises(DuplicateKeyError):
+            await async_session.create(collection, {'id': 1, 'text': 'test'})
+
+        items = await asyncio.gather(*[
+            async_session.get(collection, [('=', 'id', i)])
+            for i in range(1, size + 1)
+        ])
+        assert [item['id'] for item in items] == list(range(1, size + 1))
+
+        await async_session.update(
+            collection, {'text': 'updated'}, [('=', 'id', 1)])
+        item = await async_session.get(collection, [('=', 'id', 1)])
+        assert item['text'] == 'updated'
+
+        await async_session.delete(collection, [('=', 'id', 1)])
+        assert not await async_session.exist(collection, [('=', 'id', 1)])
+        items = await async_session.filter(collection, limit=None)
+        assert len(items) == size - 1
+
+        columns, rows = await async_session.filter(
+            collection, [('=', 'id', 2)], fields=['id', 'text'],
+            result_format='tuples')
+        assert columns == ['id', 'text']
+        assert rows == [(2, 'test')]
+        items = await async_session.filter(
+            collection, fields=['id'], limit=None, result_format='columns')
+        assert sorted(items['id']) == list(range(2, size + 1))
+
+        await async_session.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def gather(session, create_test_table, size=100):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    assert session.map('create', [(collection, item) for item in data]) == [None] * size
+
+    items = session.map('get', [(collection, [('=', 'id', i)]) for i in range(1, size + 1)])
+    assert items == data
+
+    results = session.gather([
+        ('create', (collection, data[0])),
+        ('exist', (collection, [('=', 'id', 1)])),
+        ('filter', (collection, ), {'limit': None}),
+    ])
+    assert isinstance(results[0], DuplicateKeyError)
+    assert results[1] is True
+    assert len(results[2]) == size
+
+    with pytest.raises(DuplicateKeyError):
+        session.gather([('create', (collection, data[0]))], raise_on_error=True)
+
+
+def cache(session, create_test_table):
+    collection = create_test_table(session)
+
+    session.create(collection, {'id': 1, 'text': 'test'})
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'test'
+    info = session.cache_info()
+    assert info['hits'] == 1 and info['misses'] == 1
+
+    session.update(collection, {'text': 'updated'}, [('=', 'id', 1)])
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'updated'
+
+    items = session.filter(collection, limit=None)
+    items[0]['text'] = 'changed'
+    assert session.filter(collection, limit=None)[0]['text'] == 'updated'
+
+    session.create_many(collection, [{'id': 2, 'text': 'test'}])
+    assert len(session.filter(collection, limit=None)) == 2
+    assert session.get_many(collection, [1, 2, 3]).keys() == {1, 2}
+
+    session.delete(collection, [('=', 'id', 2)])
+    assert not session.exist(collection, [('=', 'id', 2)])
+    assert session.get_many(collection, [1, 2, 3]).keys() == {1}
+
+
+def single_flight(session, create_test_table, size=100):
+    collection = create_test_table(session)
+
+    session.create(collection, {'id': 1, 'text': 'test'})
+
+    pool = ThreadPool(size)
+    items = pool.map(
+        lambda _: session.get(collection, [('=', 'id', 1)]), range(size))
+    assert items == [{'id': 1, 'text': 'test'}] * size
+    assert session.cache_info()['coalesced'] < size
+
+    session.update(collection, {'text': 'updated'}, [('=', 'id', 1)])
+    items = pool.map(
+        lambda _: session.get(collection, [('=', 'id', 1)]), range(size))
+    assert items == [{'id': 1, 'text': 'updated'}] * size
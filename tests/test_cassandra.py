@@ -1,5 +1,6 @@
 from .operations import (
-    create, delete, normal_filter, thread_pool, update, timeout
+    create, delete, normal_filter, thread_pool, update, timeout,
+    create_many_concurrent, async_operations, result_format, retry_policy
 )
 
 from curd import Session
@@ -19,5 +20,20 @@ def test_cassandra():
     update(session, create_test_table)
     delete(session, create_test_table)
     normal_filter(session, create_test_table)
+    result_format(session, create_test_table)
     thread_pool(session, create_test_table)
     timeout(session, create_test_table)
+    create_many_concurrent(session, create_test_table)
+    async_operations(session, create_test_table)
+
+
+def test_cassandra_retry_policy():
+    conf = {
+        'type': 'cassandra',
+        'conf': dict(
+            cassandra_conf['conf'],
+            retry={'base_delay': 0.01, 'budget': {'ratio': 0.1, 'capacity': 10}}
+        )
+    }
+    session = Session([conf])
+    retry_policy(session, create_test_table)
@@ -1,11 +1,13 @@
 import time
 import pytest
 from .operations import (
-    delete, normal_filter, filter_with_order_by, thread_pool, update
+    delete, normal_filter, filter_with_order_by, thread_pool, update,
+    iter_filter, scan, upsert_fields_not_supported
 )
 from phoenixdb.errors import NotSupportedError
 
 from curd import Session
+from curd.connections.hbase import UrlBalancer
 from .conf import hbase_conf
 
     
@@ -43,11 +45,70 @@ def update(session, create_test_table):
         session.update(collection, {'text': 't2'}, [('=', 'id', data['id'])])
 
 
+def create_many(session, create_test_table, size=1000):
+    collection = create_test_table(session)
+
+    data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+    status = session.create_many(collection, data, chunk_size=100)
+    assert [s['rows'] for s in status] == [100] * (size // 100)
+    assert sorted(session.filter(collection, limit=None), key=lambda i: i['id']) == data
+
+    data = {'id': [1, 2], 'text': ['replaced', 'replaced']}
+    session.create_many(collection, data, mode='replace')
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'replaced'
+
+    session.create_many(collection, [{'id': 1, 'text': 'ignored'}], mode='ignore')
+    assert session.get(collection, [('=', 'id', 1)])['text'] == 'replaced'
+
+
+class CountingClient(object):
+    def __init__(self, client):
+        self._client = client
+        self.calls = 0
+
+    def __getattr__(self, item):
+        attr = getattr(self._client, item)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+def create_many_round_trips(session, create_test_table, size=250):
+    collection = create_test_table(session)
+    pool = session.using()
+
+    conn = pool.acquire()
+    try:
+        conn.ping()
+        client = conn.conn._client = CountingClient(conn.conn._client)
+        data = [{'id': i, 'text': 'test'} for i in range(1, size + 1)]
+        conn.create_many(collection, data, chunk_size=100)
+    finally:
+        pool.release(conn)
+
+    # one prepare per chunk, one execute per row
+    assert client.calls == size + 3
+    assert len(session.filter(collection, limit=None)) == size
+
+
 def test_hbase():
     session = Session([hbase_conf])
     print('>>>>>>>>>>>>>> test create <<<<<<<<<<<<<<<<<')
     create(session, create_test_table)
 
+    print('>>>>>>>>>>>>>> test create many <<<<<<<<<<<<<<<<<')
+    create_many(session, create_test_table)
+
+    print('>>>>>>>>>>>>>> test create many round trips <<<<<<<<<<<<<<<<<')
+    create_many_round_trips(session, create_test_table)
+
+    print('>>>>>>>>>>>>>> test upsert fields <<<<<<<<<<<<<<<<<')
+    upsert_fields_not_supported(session, create_test_table)
+
     print('>>>>>>>>>>>>>> test update <<<<<<<<<<<<<<<<<')
     update(session, create_test_table)
 
@@ -63,3 +124,53 @@ def test_hbase():
     print('>>>>>>>>>>>>>> test multi thread create <<<<<<<<<<<<<<<<<')
     thread_pool(session, create_test_table, size=100)
 
+    print('>>>>>>>>>>>>>> test iter filter <<<<<<<<<<<<<<<<<')
+    iter_filter(session, create_test_table)
+
+    print('>>>>>>>>>>>>>> test scan <<<<<<<<<<<<<<<<<')
+    scan(session, create_test_table, size=100)
+
+
+def test_hbase_url_health():
+    url = hbase_conf['conf']['urls'][0]
+    down_url = 'http://127.0.0.1:1/'
+    conf = {
+        'type': 'hbase',
+        'conf': dict(hbase_conf['conf'], urls=[down_url, url], max_op_fail_retry=3)
+    }
+    session = Session([conf])
+
+    print('>>>>>>>>>>>>>> test url health <<<<<<<<<<<<<<<<<')
+    thread_pool(session, create_test_table, size=100)
+    status = session.using().url_status()
+    assert status[url]['healthy']
+    assert not status[down_url]['healthy']
+
+
+def test_hbase_url_probe_released():
+    balancer = UrlBalancer(['http://a/', 'http://b/'], backoff=0.1)
+    balancer.mark_down('http://a/')
+    time.sleep(0.1)
+
+    # probe connection closed without any operation
+    url, probe = balancer.acquire()
+    assert url == 'http://a/' and probe is not None
+    balancer.release(url, probe)
+    url, probe = balancer.acquire()
+    assert url == 'http://a/' and probe is not None
+
+    # other connections to the url do not end the probe
+    balancer.release('http://a/')
+    assert balancer.acquire() == ('http://b/', None)
+    balancer.release(url, probe)
+    assert balancer.acquire()[0] == 'http://a/'
+
+
+def test_hbase_url_balancer_after_fork():
+    balancer = UrlBalancer(['http://a/', 'http://b/'])
+    # lock held by a thread of parent process when it forked
+    balancer._lock.acquire()
+    balancer.pid = -1
+    url, probe = balancer.acquire()
+    assert url == 'http://a/' and probe is None
+    assert balancer.status()[url]['connections'] == 1
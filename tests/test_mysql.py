@@ -1,8 +1,22 @@
 from .operations import (
     create, delete, normal_filter, filter_with_order_by, thread_pool, update,
-    create_many)
+    create_many, bounded_pool, warmup_pool, iter_filter,
+    scan, create_many_chunks, create_many_columns, async_session, gather, upsert,
+    update_many, delete_many, get_many, cache, single_flight, result_format)
 
-from curd import Session
+import time
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from curd import (
+    Session, AsyncSession, ConnectError, CircuitOpenError, OperationFailure,
+    PoolTimeout
+)
+from curd.connections.mysql import MysqlConnectionPool
+from curd.connections.utils.sql import (
+    query_parameters_from_filter, statement_cache_info, clear_statement_cache
+)
 from .conf import mysql_conf
 
 
@@ -18,8 +32,208 @@ def test_mysql():
     session = Session([mysql_conf])
     create(session, create_test_table)
     create_many(session, create_test_table)
+    create_many_chunks(session, create_test_table)
+    create_many_columns(session, create_test_table)
+    upsert(session, create_test_table)
     update(session, create_test_table)
+    update_many(session, create_test_table)
     delete(session, create_test_table)
+    delete_many(session, create_test_table)
     normal_filter(session, create_test_table)
+    get_many(session, create_test_table)
     filter_with_order_by(session, create_test_table)
+    result_format(session, create_test_table)
+    thread_pool(session, create_test_table)
+    iter_filter(session, create_test_table)
+    scan(session, create_test_table)
+    gather(session, create_test_table)
+
+
+def test_mysql_bounded_pool():
+    conf = {'type': 'mysql', 'conf': dict(mysql_conf['conf'], max_size=5)}
+    session = Session([conf])
+    bounded_pool(session, create_test_table)
+
+
+def test_mysql_idle_eviction():
+    conf = dict(mysql_conf['conf'], max_idle_time=0.1)
+    pool = MysqlConnectionPool(conf)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    assert pool.idle_size == 3
+
+    # pool went quiet after a burst, idle connections are evicted on acquire
+    time.sleep(0.2)
+    conn = pool.acquire()
+    assert conn not in conns
+    assert pool.size == 1 and pool.idle_size == 0
+    pool.release(conn)
+    pool.close()
+
+
+def test_mysql_warmup_pool():
+    conf = {'type': 'mysql', 'conf': dict(mysql_conf['conf'], warmup=3)}
+    session = Session([conf])
+    warmup_pool(session, create_test_table)
+
+
+def test_mysql_async_session():
+    session = Session([mysql_conf])
+    async_session(session, AsyncSession([mysql_conf]), create_test_table)
+
+
+def test_mysql_cache():
+    conf = dict(mysql_conf, cache={'size': 100, 'ttl': 60})
+    session = Session([conf])
+    cache(session, create_test_table)
+
+
+def test_mysql_single_flight():
+    conf = dict(mysql_conf, single_flight=True)
+    session = Session([conf])
+    single_flight(session, create_test_table)
+
+
+def test_mysql_replicas():
+    conf = {
+        'type': 'mysql',
+        'conf': {
+            'primary': mysql_conf['conf'],
+            'replicas': [mysql_conf['conf'], mysql_conf['conf']],
+            'balance': 'least_in_flight',
+            'read_your_writes': 1
+        }
+    }
+    session = Session([conf])
+    create(session, create_test_table)
+    update(session, create_test_table)
+    normal_filter(session, create_test_table)
     thread_pool(session, create_test_table)
+    assert session.using().in_flight == [0, 0]
+
+
+def test_mysql_circuit_breaker():
+    changes = []
+    conf = {
+        'type': 'mysql',
+        'conf': dict(mysql_conf['conf'], port=1),
+        'circuit_breaker': {
+            'failure_threshold': 3,
+            'reset_timeout': 0.5,
+            'on_state_change': lambda breaker, old, new: changes.append(new)
+        }
+    }
+    session = Session([conf])
+    for _ in range(3):
+        with pytest.raises(ConnectError):
+            session.filter('curd.test')
+    with pytest.raises(CircuitOpenError):
+        session.filter('curd.test')
+    assert session.using().circuit_info()['state'] == 'open'
+
+    time.sleep(0.5)
+    with pytest.raises(ConnectError):
+        session.filter('curd.test')
+    assert changes == ['open', 'half_open', 'open']
+
+
+def test_mysql_circuit_breaker_half_open():
+    conf = dict(mysql_conf, circuit_breaker={
+        'failure_threshold': 1, 'reset_timeout': 0.5})
+    session = Session([conf])
+    collection = create_test_table(session)
+    session.create(collection, {'id': 1, 'text': 'test'})
+    breaker = session.using().breaker
+
+    def open_circuit():
+        breaker.after_call(
+            breaker.before_call(), OperationFailure(origin_error=Exception()))
+        time.sleep(0.5)
+
+    # abandoned iterators give their probe back
+    open_circuit()
+    session.scan(collection)
+    rows = session.iter_filter(collection)
+    next(rows)
+    del rows
+    rows = session.scan(collection)
+    next(rows)
+    rows.close()
+    assert breaker.state == 'half_open'
+
+    # only a successful probe closes the circuit
+    breaker.after_call(
+        breaker.before_call(), PoolTimeout(origin_error=Exception()))
+    assert breaker.state == 'half_open'
+    assert session.get(collection, [('=', 'id', 1)])['id'] == 1
+    assert breaker.state == 'closed'
+
+
+def test_mysql_retry_policy():
+    conf = {
+        'type': 'mysql',
+        'conf': dict(mysql_conf['conf'], max_op_fail_retry=3, retry={
+            'base_delay': 0.05,
+            'max_delay': 0.1,
+            'budget': {'ratio': 0.1, 'min_rate': 0, 'capacity': 4}
+        })
+    }
+    session = Session([conf])
+    conn = session.using().get_connection()
+
+    attempts = []
+
+    def fail():
+        attempts.append(time.monotonic())
+        raise OperationFailure(origin_error=Exception('gone away'))
+
+    # jittered delays below min(max_delay, base_delay * 2 ** n)
+    with pytest.raises(OperationFailure):
+        conn._call_with_retry(fail, 3)
+    assert len(attempts) == 4
+    delays = [b - a for a, b in zip(attempts, attempts[1:])]
+    for n, delay in enumerate(delays):
+        assert delay < min(0.1, 0.05 * 2 ** n) + 0.05
+    assert session.retry_info() == {
+        'requests': 1, 'retries': 3, 'gave_up': 1, 'budget_exhausted': 0}
+
+    # 1.2 tokens left, one retry, then budget is exhausted
+    with pytest.raises(OperationFailure):
+        conn._call_with_retry(fail, 3)
+    assert len(attempts) == 6
+    assert session.retry_info() == {
+        'requests': 2, 'retries': 4, 'gave_up': 1, 'budget_exhausted': 1}
+
+
+def test_statement_cache():
+    clear_statement_cache()
+    first = query_parameters_from_filter(
+        'curd.test', [('=', 'id', 1), ('IN', 'text', ['a', 'b'])], ['id'])
+    info = statement_cache_info()
+    assert info['misses'] >= 1
+    assert info['size'] >= 1
+
+    # same shape, other values
+    second = query_parameters_from_filter(
+        'curd.test', [('=', 'id', 2), ('IN', 'text', ['c', 'd'])], ['id'])
+    assert first[0] == second[0]
+    assert second[1] != first[1]
+    again = statement_cache_info()
+    assert again['hits'] > info['hits']
+    assert again['misses'] == info['misses']
+    assert again['size'] == info['size']
+
+
+def test_session_executor():
+    session = Session()
+    with ThreadPool(16) as pool:
+        executors = pool.map(lambda _: session._get_executor(4), range(100))
+    assert len(set(map(id, executors))) == 1
+
+    # lock held by a thread of parent process when it forked
+    session._executors_lock.acquire()
+    session._pid = -1
+    assert session._get_executor(4) is not executors[0]
+    session.close()
+    executors[0].shutdown()